@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from extraction_engine import ExtractionEngine
+from get_daily_precip import fetch_precipitation
+from get_mndwi_values import get_mndwi, mndwi_from_stack
+from get_ndbi_values import get_ndbi, ndbi_from_stack
+from get_ndvi_values import get_ndvi, ndvi_from_stack
+from get_ndwi_values import get_ndwi, ndwi_from_stack
+from get_slope_values import SLOPE_COLUMNS, get_slope, slopes_from_stack
+from get_spectral_indices import INDICES, get_spectral_indices, spectral_indices_from_stacks
+from metrics import Metrics
+from mock_servers import MockServers
+from paths import DATA_DIR
+from statistical_api import SERIES_INTERVAL, StatisticsEngine
+from token_manager import TokenManager
+
+BENCHMARK_DIR = os.path.join(DATA_DIR, "benchmarks")
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+LOCATION_COUNT = 500
+# Locations are spread over the Alps in clusters of about ten, like plants
+# along the same river, so tile batching gets exercised
+LOCATION_BOUNDS = (5.0, 44.0, 16.0, 48.0)
+CLUSTER_SIZE = 10
+CLUSTER_SPREAD_DEG = 0.01
+# Fine latency buckets, so the tail percentiles are precise to a few percent
+BENCHMARK_BUCKETS = tuple(round(0.001 * 1.05 ** i, 6) for i in range(250))
+REGRESSION_TOLERANCE = 0.10  # relative change reported as a regression
+
+
+def synthetic_locations(count=LOCATION_COUNT, bounds=LOCATION_BOUNDS, seed=0):
+    rng = np.random.default_rng(seed)
+    clusters = max(count // CLUSTER_SIZE, 1)
+    centers = rng.uniform(bounds[:2], bounds[2:], (clusters, 2))[rng.integers(clusters, size=count)]
+    lons, lats = (centers + rng.normal(0, CLUSTER_SPREAD_DEG, (count, 2))).T
+    return pd.DataFrame({
+        "name": [f"location {i}" for i in range(count)],
+        "latitude": lats.round(6),
+        "longitude": lons.round(6),
+    })
+
+
+def _process_extractor(build_request, reduce_stack, column, accept=None):
+    def run(engine_kwargs, servers, locations):
+        engine = ExtractionEngine(api_url=servers.process_url, **engine_kwargs)
+        return engine.run(locations, build_request, reduce_stack, column, accept=accept, desc="Benchmark")
+    return run
+
+
+def _statistics_extractor(build_request, output, interval=None):
+    def run(engine_kwargs, servers, locations):
+        engine = StatisticsEngine(api_url=servers.statistics_url, interval=interval, **engine_kwargs)
+        return engine.run(locations, build_request, output, desc="Benchmark")
+    return run
+
+
+def _precipitation(engine_kwargs, servers, locations):
+    values = fetch_precipitation(locations["latitude"], locations["longitude"], metrics=engine_kwargs["metrics"],
+                                 url=servers.open_meteo_url)
+    return [{"precipitation": None if np.isnan(value) else value} for value in values]
+
+
+# Every extractor calling a remote API, run as in its main() but against the
+# mock servers. Discharge and the local DEM, ERA5 and Sentinel-2 backends
+# read local files only and are not covered.
+EXTRACTORS = {
+    "ndvi": _process_extractor(get_ndvi, ndvi_from_stack, "ndvi"),
+    "ndwi": _process_extractor(get_ndwi, ndwi_from_stack, "ndwi"),
+    "ndbi": _process_extractor(get_ndbi, ndbi_from_stack, "ndbi"),
+    "mndwi": _process_extractor(get_mndwi, mndwi_from_stack, "mndwi"),
+    "spectral_indices": _process_extractor(get_spectral_indices, spectral_indices_from_stacks, INDICES,
+                                           accept="application/tar"),
+    "slope": _process_extractor(get_slope, slopes_from_stack, SLOPE_COLUMNS),
+    "ndvi_statistics": _statistics_extractor(get_ndvi, "ndvi"),
+    "ndvi_series": _statistics_extractor(get_ndvi, "ndvi", interval=SERIES_INTERVAL),
+    "precipitation": _precipitation,
+}
+
+
+def _percentile(histogram, q):
+    # Upper bound of the bucket holding the q-quantile
+    target = q * histogram["count"]
+    for bound, cumulative in histogram["buckets"].items():
+        if cumulative >= target:
+            return float(bound)
+    return float("inf")
+
+
+def run_extractor(name, servers, locations, max_concurrency=16, workdir=None):
+    """
+    Run one extractor against the mock servers, without response cache,
+    checkpoints or rate limiter so every location is requested.
+    Returns its benchmark result: throughput, latency percentiles and retry
+    overhead.
+    """
+    metrics = Metrics(f"benchmark_{name}", directory=workdir or tempfile.mkdtemp(), prometheus_dir=None,
+                      buckets=BENCHMARK_BUCKETS)
+    engine_kwargs = {
+        "token_manager": TokenManager({"client_id": "benchmark", "client_secret": "benchmark"},
+                                      auth_url=servers.auth_url),
+        "max_concurrency": max_concurrency,
+        "cache": False,
+        "limiter": False,
+        "metrics": metrics,
+    }
+    start = time.perf_counter()
+    results = EXTRACTORS[name](engine_kwargs, servers, locations)
+    wall = time.perf_counter() - start
+
+    summary = metrics.summary()
+    counters = summary["counters"]
+    requests = sum(v for k, v in counters.items() if k.startswith("requests"))
+    successful = sum(v for k, v in counters.items() if k.startswith("requests") and 'status="200"' in k)
+    latency = summary["histograms"].get("request_latency_seconds", {"count": 0, "buckets": {}})
+    extracted = sum(any(v is not None for k, v in r.items() if k not in ("name", "latitude", "longitude"))
+                    for r in results)
+    return {
+        "locations": len(locations),
+        "extracted": extracted,
+        "wall_seconds": wall,
+        "locations_per_second": len(locations) / wall,
+        "requests": requests,
+        "locations_per_request": len(locations) / successful if successful else None,
+        "latency_p50": _percentile(latency, 0.5) if latency["count"] else None,
+        "latency_p90": _percentile(latency, 0.9) if latency["count"] else None,
+        "latency_p99": _percentile(latency, 0.99) if latency["count"] else None,
+        # Requests beyond the successful ones: throttled, failed and retried
+        "retry_overhead": (requests - successful) / successful if successful else None,
+        "stages": {stage: stats["seconds"] for stage, stats in summary["stages"].items()},
+    }
+
+
+def run(extractors=None, locations=LOCATION_COUNT, latency=0.05, jitter=0.5, error_rates=None, retry_after=0.2,
+        max_concurrency=16):
+    """
+    Benchmark the extractors against freshly started mock servers.
+    Returns {"settings": ..., "results": {extractor: result}}.
+    """
+    settings = {"locations": locations, "latency": latency, "jitter": jitter,
+                "error_rates": {str(k): v for k, v in (error_rates or {}).items()},
+                "retry_after": retry_after, "max_concurrency": max_concurrency}
+    sample = synthetic_locations(locations)
+    results = {}
+    with MockServers(latency, jitter, error_rates, retry_after) as servers, \
+            tempfile.TemporaryDirectory() as workdir:
+        for name in extractors or EXTRACTORS:
+            print(f"[benchmark] {name}")
+            results[name] = run_extractor(name, servers, sample, max_concurrency, workdir)
+    return {"settings": settings, "results": results}
+
+
+def _change(value, reference):
+    if value is None or not reference:
+        return ""
+    return f"{(value - reference) / reference:+.0%}"
+
+
+def report(benchmark, baseline=None):
+    """
+    Print the results, with the relative change to a baseline run if given.
+    Returns the names of the extractors that regressed by more than
+    REGRESSION_TOLERANCE in throughput or p99 latency.
+    """
+    reference = (baseline or {}).get("results", {})
+    regressions = []
+    print(f"\n{'extractor':<18}{'loc/s':>10}{'':>7}{'p50 ms':>9}{'p99 ms':>9}{'':>7}{'loc/req':>9}"
+          f"{'retries':>9}{'wall s':>9}")
+    for name, result in benchmark["results"].items():
+        base = reference.get(name, {})
+        p50, p99 = result["latency_p50"], result["latency_p99"]
+        print(f"{name:<18}{result['locations_per_second']:>10.1f}"
+              f"{_change(result['locations_per_second'], base.get('locations_per_second')):>7}"
+              f"{p50 * 1000 if p50 is not None else float('nan'):>9.0f}"
+              f"{p99 * 1000 if p99 is not None else float('nan'):>9.0f}"
+              f"{_change(p99, base.get('latency_p99')):>7}"
+              f"{result['locations_per_request'] or float('nan'):>9.1f}"
+              f"{result['retry_overhead'] if result['retry_overhead'] is not None else float('nan'):>9.1%}"
+              f"{result['wall_seconds']:>9.1f}")
+        if base and (result["locations_per_second"] < base["locations_per_second"] * (1 - REGRESSION_TOLERANCE)
+                     or (p99 and base.get("latency_p99")
+                         and p99 > base["latency_p99"] * (1 + REGRESSION_TOLERANCE))):
+            regressions.append(name)
+    if baseline is not None and baseline.get("settings") != benchmark["settings"]:
+        print("Note: the baseline was measured with different settings")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the extractors against local mock APIs.")
+    parser.add_argument("extractors", nargs="*", metavar="extractor",
+                        help=f"extractors to run: {', '.join(EXTRACTORS)} (default: all)")
+    parser.add_argument("-n", "--locations", type=int, default=LOCATION_COUNT)
+    parser.add_argument("--latency", type=float, default=0.05, help="median mock latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="log-normal spread of the latency")
+    parser.add_argument("--throttled", type=float, default=0.0, help="rate of 429 responses")
+    parser.add_argument("--server-errors", type=float, default=0.0, help="rate of 503 responses")
+    parser.add_argument("--unauthorized", type=float, default=0.0, help="rate of 401 responses")
+    parser.add_argument("--concurrency", type=int, default=16, help="max requests in flight per extractor")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.extractors if name not in EXTRACTORS]
+    if unknown:
+        parser.error(f"unknown extractors: {', '.join(unknown)}")
+
+    error_rates = {status: rate for status, rate in
+                   ((401, args.unauthorized), (429, args.throttled), (503, args.server_errors)) if rate}
+    benchmark = run(args.extractors or None, args.locations, args.latency, args.jitter, error_rates,
+                    max_concurrency=args.concurrency)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(benchmark, baseline)
+
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    paths = [os.path.join(BENCHMARK_DIR, "latest.json")] + ([args.baseline] if args.save_baseline else [])
+    for path in paths:
+        with open(path, "w") as f:
+            json.dump(benchmark, f, indent=2)
+    print(f"Results written to {', '.join(paths)}")
+    if regressions:
+        print(f"Regressions against {args.baseline}: {', '.join(regressions)}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+from paths import INTERMEDIARY_DIR
+
+CHECKPOINT_PATH = os.path.join(INTERMEDIARY_DIR, "checkpoints.sqlite")
+BATCH_SIZE = 200  # results per commit
+COMMIT_INTERVAL = 10  # max seconds between commits
+
+
+def location_key(latitude, longitude):
+    return (round(float(latitude), 6), round(float(longitude), 6))
+
+
+def coordinate_keys(latitudes, longitudes):
+    """
+    Vectorized integer location keys: latitude and longitude quantized to
+    int32 micro-degrees and packed into one int64.
+    """
+    lat_e6 = np.rint(np.asarray(latitudes, dtype=np.float64) * 1e6).astype(np.int64)
+    lon_e6 = np.rint(np.asarray(longitudes, dtype=np.float64) * 1e6).astype(np.int64)
+    return (lat_e6 << 32) | (lon_e6 & 0xFFFFFFFF)
+
+
+def config_hash(config):
+    """
+    Short content hash of an extractor configuration, e.g. its request payload.
+    """
+    if config is None:
+        return None
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _to_json_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (str, list)):
+        # Lists hold JSON-ready rows, e.g. a location's time series
+        return value
+    return float(value)
+
+
+class CheckpointStore:
+    """
+    Append-only store of extraction results shared by all extractors.
+
+    Results are kept in a SQLite table keyed on (extractor, latitude, longitude)
+    and mirrored in an in-memory dict, so "already done?" checks are O(1).
+    New results are buffered and committed in batches; a commit is atomic, so
+    after a crash the store resumes from the last committed batch.
+
+    Every result is stored with the hash of the extractor's `config`, so a
+    (location, feature) cell is only reused while the configuration that
+    produced it is unchanged. Results from older configurations are not
+    loaded and get extracted again; rows stored before configurations were
+    tracked are kept.
+    """
+
+    def __init__(self, extractor, path=CHECKPOINT_PATH, batch_size=BATCH_SIZE, commit_interval=COMMIT_INTERVAL,
+                 config=None):
+        self.extractor = extractor
+        self.config_hash = config_hash(config)
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self._pending = []
+        self._last_commit = time.monotonic()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "extractor TEXT, latitude REAL, longitude REAL, name TEXT, payload TEXT, "
+            "PRIMARY KEY (extractor, latitude, longitude)) WITHOUT ROWID"
+        )
+        if "config" not in [row[1] for row in self._db.execute("PRAGMA table_info(results)")]:
+            self._db.execute("ALTER TABLE results ADD COLUMN config TEXT")
+        self._db.commit()
+
+        self._results = {}
+        rows = self._db.execute(
+            "SELECT latitude, longitude, name, payload FROM results "
+            "WHERE extractor = ? AND (config IS NULL OR config IS ?)",
+            (extractor, self.config_hash),
+        )
+        for latitude, longitude, name, payload in rows:
+            self._results[(latitude, longitude)] = {
+                "name": name, "latitude": latitude, "longitude": longitude, **json.loads(payload)
+            }
+        print(f"Loaded {len(self._results)} {extractor} checkpoints.")
+
+    def __len__(self):
+        return len(self._results)
+
+    def __contains__(self, key):
+        return key in self._results
+
+    def get(self, key):
+        return self._results.get(key)
+
+    def add(self, result):
+        """
+        Record a result dict with 'name', 'latitude', 'longitude' and the
+        extracted value(s). Results where every value is missing are not
+        recorded, so they are retried on the next run.
+        """
+        values = {
+            k: _to_json_value(v) for k, v in result.items()
+            if k not in ("name", "latitude", "longitude")
+        }
+        if all(v is None for v in values.values()):
+            return
+
+        key = location_key(result["latitude"], result["longitude"])
+        name = result["name"] if isinstance(result["name"], str) else None
+        self._results[key] = {"name": name, "latitude": key[0], "longitude": key[1], **values}
+        self._pending.append((self.extractor, key[0], key[1], name, json.dumps(values), self.config_hash))
+
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._last_commit >= self.commit_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Durably commit all buffered results.
+        """
+        if self._pending:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results (extractor, latitude, longitude, name, payload, config) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+            self._db.commit()
+            self._pending = []
+        self._last_commit = time.monotonic()
+
+    def results(self):
+        return list(self._results.values())
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,65 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import from_bounds
+
+DEM_TILE_DEG = 1.0  # Copernicus DEM tiles cover 1x1 degree
+READ_CHUNK = 256  # locations read by one worker in a row
+
+
+def read_dem_windows(path, lats, lons, buffer_deg=0.0045, window_px=50, workers=None):
+    """
+    Read the DEM window around every location from a local mosaic.
+
+    path: Copernicus DEM GeoTIFF or VRT mosaic in EPSG:4326, e.g. built with
+        `gdalbuildvrt cop_dem_30.vrt tiles/*.tif`
+    buffer_deg: half the size of a window in degrees, as in get_slope
+    window_px: windows are resampled to window_px x window_px like the
+        Process API output
+
+    Locations are grouped by DEM tile, in chunks of READ_CHUNK, so each worker
+    thread reads from the same source file in a row, and only the window of
+    each location is read.
+    Returns a float32 array of shape (N, window_px, window_px) with NaN for
+    nodata and for parts of a window outside the mosaic.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    stack = np.full((len(lats), window_px, window_px), np.nan, dtype=np.float32)
+    if len(lats) == 0:
+        return stack
+
+    tile_keys = np.stack([np.floor(lats / DEM_TILE_DEG), np.floor(lons / DEM_TILE_DEG)], axis=1)
+    _, tile_ids = np.unique(tile_keys, axis=0, return_inverse=True)
+    order = np.argsort(tile_ids.ravel(), kind="stable")
+    groups = [
+        group[start:start + READ_CHUNK]
+        for group in np.split(order, np.flatnonzero(np.diff(tile_ids.ravel()[order])) + 1)
+        for start in range(0, len(group), READ_CHUNK)
+    ]
+
+    def read_group(indices):
+        # Dataset handles are not thread safe, so every group opens its own
+        with rasterio.open(path) as src:
+            for i in indices:
+                window = from_bounds(
+                    lons[i] - buffer_deg, lats[i] - buffer_deg, lons[i] + buffer_deg, lats[i] + buffer_deg,
+                    transform=src.transform,
+                )
+                # Boundless reads are much slower, only use them at the mosaic edges
+                inside = (window.col_off >= 0 and window.row_off >= 0
+                          and window.col_off + window.width <= src.width
+                          and window.row_off + window.height <= src.height)
+                arr = src.read(
+                    1, window=window, out_shape=(window_px, window_px), boundless=not inside,
+                    masked=True, resampling=Resampling.nearest,
+                )
+                stack[i] = arr.astype(np.float32).filled(np.nan)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(read_group, groups))
+
+    return stack
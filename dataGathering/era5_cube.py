@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import xarray as xr
+
+TIME_CHUNK = 24 * 31  # time steps read at once, one month of hourly data
+
+
+def open_cube(path):
+    """
+    Open a local ERA5 precipitation cube stored as NetCDF or Zarr.
+    Data is read lazily, so only the slices used below are loaded.
+    """
+    if path.rstrip("/").endswith(".zarr") or os.path.isdir(path):
+        return xr.open_zarr(path)
+    return xr.open_dataset(path)
+
+
+def _coord_name(ds, *names):
+    for name in names:
+        if name in ds.coords:
+            return name
+    raise KeyError(f"None of the coordinates {names} found in the ERA5 cube")
+
+
+def _index_range(values, low, high):
+    """
+    Slice over the coordinate values within [low, high], for ascending or descending axes.
+    """
+    idx = np.flatnonzero((values >= low) & (values <= high))
+    if len(idx) == 0:
+        return slice(0, 0)
+    return slice(idx.min(), idx.max() + 1)
+
+
+def mean_daily_precipitation(path, lats, lons, start_date="2024-01-01", end_date="2024-12-31",
+                             variable="tp", method="nearest", time_chunk=TIME_CHUNK):
+    """
+    Mean daily precipitation (mm) for many locations from a local ERA5 cube.
+
+    The cube is cut to the bounding box of the locations and summed over the
+    time range in chunks of `time_chunk` steps, giving one total per grid cell.
+    All locations are then sampled from that field at once, either from the
+    nearest cell or with bilinear interpolation (method="bilinear").
+    Works with hourly or daily data in metres (ERA5 'tp') or millimetres.
+
+    Returns an array with one value per location, NaN outside the cube or
+    where it has no data.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if len(lats) == 0:
+        return np.array([], dtype=np.float64)
+
+    ds = open_cube(path)
+    lat_name = _coord_name(ds, "latitude", "lat")
+    lon_name = _coord_name(ds, "longitude", "lon")
+    time_name = _coord_name(ds, "valid_time", "time")
+
+    # ERA5 from the CDS uses 0..360 longitudes. The cube is shifted to
+    # -180..180 rather than the points, so locations on both sides of 0° fall
+    # between neighbouring columns and their bounding box stays small
+    if float(ds[lon_name].max()) > 180:
+        ds = ds.assign_coords({lon_name: ((ds[lon_name] + 180) % 360) - 180}).sortby(lon_name)
+
+    da = ds[variable].sel({time_name: slice(start_date, f"{end_date}T23:59:59")}).squeeze(drop=True)
+    da = da.transpose(time_name, lat_name, lon_name)
+
+    # Only read the cells around the locations, with one cell of margin
+    lat_values = da[lat_name].values
+    lon_values = da[lon_name].values
+    margin = max(np.abs(np.diff(lat_values)).max(initial=0), np.abs(np.diff(lon_values)).max(initial=0))
+    da = da.isel({
+        lat_name: _index_range(lat_values, lats.min() - margin, lats.max() + margin),
+        lon_name: _index_range(lon_values, lons.min() - margin, lons.max() + margin),
+    })
+
+    total = np.zeros(da.shape[1:], dtype=np.float64)
+    valid = np.zeros(da.shape[1:], dtype=bool)
+    for start in range(0, da.sizes[time_name], time_chunk):
+        block = da.isel({time_name: slice(start, start + time_chunk)}).values
+        total += np.nansum(block, axis=0)
+        valid |= ~np.isnan(block).all(axis=0)
+
+    n_days = np.unique(da[time_name].values.astype("datetime64[D]")).size
+    scale = 1000.0 if da.attrs.get("units") == "m" else 1.0
+    field = np.where(valid, total * scale / max(n_days, 1), np.nan)
+
+    rows = _fractional_index(da[lat_name].values, lats)
+    cols = _fractional_index(da[lon_name].values, lons)
+    return _sample(field, rows, cols, method)
+
+
+def _fractional_index(coord_values, points):
+    """
+    Position of each point along a regular coordinate axis in (fractional)
+    cell indices, NaN for points outside the axis.
+    """
+    idx = np.arange(len(coord_values), dtype=np.float64)
+    if len(coord_values) > 1 and coord_values[0] > coord_values[-1]:
+        coord_values, idx = coord_values[::-1], idx[::-1]
+    return np.interp(points, coord_values, idx, left=np.nan, right=np.nan)
+
+
+def _sample(field, rows, cols, method):
+    """
+    Sample a 2D field at fractional (row, col) positions, all points at once.
+    """
+    values = np.full(len(rows), np.nan)
+    inside = ~(np.isnan(rows) | np.isnan(cols))
+    rows, cols = rows[inside], cols[inside]
+
+    if method == "nearest":
+        values[inside] = field[np.rint(rows).astype(np.int64), np.rint(cols).astype(np.int64)]
+        return values
+
+    # Bilinear interpolation between the four surrounding cells
+    r0 = np.floor(rows).astype(np.int64)
+    c0 = np.floor(cols).astype(np.int64)
+    r1 = np.minimum(r0 + 1, field.shape[0] - 1)
+    c1 = np.minimum(c0 + 1, field.shape[1] - 1)
+    wr = rows - r0
+    wc = cols - c0
+    values[inside] = (
+        field[r0, c0] * (1 - wr) * (1 - wc)
+        + field[r0, c1] * (1 - wr) * wc
+        + field[r1, c0] * wr * (1 - wc)
+        + field[r1, c1] * wr * wc
+    )
+    return values
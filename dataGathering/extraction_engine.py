@@ -0,0 +1,314 @@
+import asyncio
+import copy
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+from tqdm import tqdm
+
+from checkpoint_store import location_key
+from metrics import Metrics
+from raster_decoding import reduce_windows
+from response_cache import ResponseCache, make_key
+from rate_limiter import SharedRateLimiter, parse_retry_after
+from tile_planner import TILE_DEG, plan_tiles
+from token_manager import TokenManager, get_token_manager
+
+API_URL = "https://sh.dataspace.copernicus.eu/api/v1/process"
+
+MAX_CONCURRENCY = 16  # upper bound, the shared limiter adapts below it
+# Account quotas of the Sentinel Hub API, adjust to your account
+REQUESTS_PER_MINUTE = 300
+PROCESSING_UNITS_PER_MINUTE = 300
+MAX_THROTTLED_RETRIES = 5  # retries after 429 responses, on top of max_retries
+PU_HEADER = "x-processingunits-spent"
+
+
+def tile_payload(payload, tile):
+    """
+    Copy of a single-location payload that requests the whole tile instead.
+    """
+    payload = copy.deepcopy(payload)
+    payload["input"]["bounds"]["bbox"] = tile.bbox
+    payload["output"]["width"] = tile.width
+    payload["output"]["height"] = tile.height
+    return payload
+
+
+def estimate_processing_units(payload):
+    """
+    Rough processing unit cost of a Process or Statistical API request,
+    following the Sentinel Hub rules: output pixels / 512x512, times input
+    bands / 3, times 2 for FLOAT32 output, with a minimum of 0.01. The number
+    of acquisitions is unknown up front; the actual cost is read from the
+    response headers.
+    """
+    # Statistical API requests keep the output size and evalscript in "aggregation"
+    output = payload.get("output") or payload["aggregation"]
+    units = max(output["width"] * output["height"] / (512 * 512), 0.01)
+    evalscript = payload.get("evalscript") or output.get("evalscript", "")
+    inputs = re.search(r"(?:input|bands)\s*:\s*\[([^\]]*)\]", evalscript)
+    if inputs:
+        units *= max(len(re.findall(r"[\"']\w+[\"']", inputs.group(1))) / 3, 1)
+    if "FLOAT32" in evalscript:
+        units *= 2
+    return units
+
+
+def sentinel_hub_limiter(max_concurrency=MAX_CONCURRENCY):
+    """
+    Limiter shared by every process calling the Sentinel Hub API.
+    """
+    return SharedRateLimiter(
+        "sentinel_hub", REQUESTS_PER_MINUTE / 60, REQUESTS_PER_MINUTE,
+        unit_rate=PROCESSING_UNITS_PER_MINUTE / 60, unit_capacity=PROCESSING_UNITS_PER_MINUTE,
+        max_concurrency=max_concurrency,
+    )
+
+
+class ExtractionEngine:
+    """
+    Runs Process API requests for many locations concurrently using asyncio.
+
+    Extractors provide a request builder, which turns a (lat, lon) pair into a
+    Process API payload, and a reducer, which turns the location's window of
+    the response raster into the extracted value; all windows of a tile are
+    reduced in one vectorized call. Nearby locations are batched
+    into tile requests (see tile_planner.py). At most `max_concurrency`
+    requests are in flight at once, while responses are decoded and reduced
+    in a pool of `decode_workers` processes so the event loop keeps fetching.
+
+    Successful responses are stored in a ResponseCache, so repeated requests
+    are served from disk. Pass cache=False to always call the API.
+
+    Access tokens come from a TokenManager, shared by all engines of the
+    process by default, which refreshes them before they expire.
+
+    Requests go through a SharedRateLimiter, which keeps every process within
+    the account's request and processing unit quotas and backs off on 429
+    responses. Pass limiter=False to disable it.
+
+    Every stage of a run (auth, rate limit waits, HTTP, cache, decode,
+    reduce, checkpoint) is timed in `metrics`, together with request
+    latencies, status, retry and error counts and processing units; the
+    summary is printed and exported at the end of run().
+    """
+
+    def __init__(self, auth_data=None, max_concurrency=MAX_CONCURRENCY, max_retries=1, api_url=API_URL,
+                 decode_workers=None, cache=None, limiter=None, token_manager=None, metrics=None):
+        if token_manager is None:
+            token_manager = TokenManager(auth_data) if auth_data is not None else get_token_manager()
+        self.token_manager = token_manager
+        self.max_concurrency = max_concurrency
+        self.decode_workers = decode_workers or os.cpu_count()
+        self.cache = ResponseCache() if cache is None else cache
+        self.limiter = sentinel_hub_limiter(max_concurrency) if limiter is None else limiter
+        self.max_retries = max_retries
+        self.api_url = api_url
+        self.metrics = metrics or Metrics("extraction")
+
+    async def _fetch(self, session, semaphore, payload, accept=None):
+        """
+        POST a payload to the Process API, retrying on failures.
+        Throttled (429) requests are retried once the limiter allows it and do
+        not count as failed attempts.
+        Returns the response body, or None if every attempt failed.
+        """
+        units = estimate_processing_units(payload)
+        async with semaphore:
+            attempts = throttled = 0
+            while attempts <= self.max_retries:
+                # Authenticated lazily, so fully cached runs never hit the identity server
+                with self.metrics.timer("auth"):
+                    token = await self.token_manager.token_async()
+                headers = {"Authorization": f"Bearer {token}"}
+                if accept is not None:
+                    headers["Accept"] = accept
+
+                with self.metrics.timer("rate_limit"):
+                    lease = await self.limiter.acquire_async(units) if self.limiter else None
+                status = retry_after = spent = None
+                start = time.perf_counter()
+                try:
+                    async with session.post(self.api_url, json=payload, headers=headers) as resp:
+                        body = await resp.read()
+                        status = resp.status
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        spent = float(resp.headers[PU_HEADER]) if PU_HEADER in resp.headers else None
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"Request failed: {e}")
+                    self.metrics.inc("errors", kind=type(e).__name__)
+                finally:
+                    latency = time.perf_counter() - start
+                    self.metrics.add_time("http", latency)
+                    self.metrics.observe("request_latency_seconds", latency)
+                    if self.limiter:
+                        await asyncio.to_thread(self.limiter.release, lease, status, retry_after, units, spent)
+
+                self.metrics.inc("processing_units_estimated", units)
+                if spent is not None:
+                    self.metrics.inc("processing_units_spent", spent)
+                if status is not None:
+                    self.metrics.inc("requests", status=status)
+
+                if status == 200:
+                    return body
+                if status == 429 and throttled < MAX_THROTTLED_RETRIES:
+                    throttled += 1
+                    self.metrics.inc("throttled_retries")
+                    if not self.limiter:
+                        await asyncio.sleep(retry_after or 1)
+                    continue
+
+                attempts += 1
+                if attempts <= self.max_retries:
+                    self.metrics.inc("retries")
+                if status is not None:
+                    print(f"Error {status}: {body.decode(errors='replace')}")
+                if status == 401:
+                    self.token_manager.invalidate(token)
+        return None
+
+    async def _fetch_cached(self, session, semaphore, payload, accept=None):
+        """
+        Like _fetch, but serves and stores responses in the response cache.
+        """
+        body = None
+        if self.cache:
+            key = make_key(self.api_url, {"payload": payload, "accept": accept})
+            with self.metrics.timer("cache"):
+                body = self.cache.get(key)
+            self.metrics.inc("cache_lookups", result="miss" if body is None else "hit")
+        if body is None:
+            body = await self._fetch(session, semaphore, payload, accept)
+            if body is not None and self.cache:
+                with self.metrics.timer("cache"):
+                    self.cache.put(key, body)
+        return body
+
+    async def _process_tile(self, session, semaphore, pool, tile, build_request, reduce_stack, column, accept):
+        lat = (tile.bbox[1] + tile.bbox[3]) / 2
+        lon = (tile.bbox[0] + tile.bbox[2]) / 2
+        payload = tile_payload(build_request(lat, lon), tile)
+        body = await self._fetch_cached(session, semaphore, payload, accept)
+
+        values = [None] * len(tile.members)
+        if body is not None:
+            offsets = [(row_off, col_off) for _, row_off, col_off in tile.members]
+            try:
+                values, timings = await asyncio.get_running_loop().run_in_executor(
+                    pool, reduce_windows, body, tile.bbox, offsets, tile.window_px, reduce_stack
+                )
+                for stage, seconds in timings.items():
+                    self.metrics.add_time(stage, seconds)
+            except Exception as e:
+                print(f"Failed to parse response for tile {tile.bbox}: {e}")
+                self.metrics.inc("errors", kind="decode")
+
+        results = []
+        for (row, _, _), value in zip(tile.members, values):
+            if isinstance(column, str):
+                results.append({**row, column: value})
+            else:
+                value = value or {}
+                results.append({**row, **{c: value.get(c) for c in column}})
+        return results
+
+    async def _run(self, tiles, build_request, reduce_stack, column, accept, on_result, desc):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=120)
+
+        with ProcessPoolExecutor(max_workers=self.decode_workers) as pool:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                tasks = [
+                    asyncio.create_task(
+                        self._process_tile(session, semaphore, pool, tile, build_request, reduce_stack, column, accept)
+                    )
+                    for tile in tiles
+                ]
+                with tqdm(total=sum(len(tile.members) for tile in tiles), desc=desc) as pbar:
+                    for future in asyncio.as_completed(tasks):
+                        results = await future
+                        pbar.update(len(results))
+                        if on_result is not None:
+                            for result in results:
+                                on_result(result)
+
+        if self.cache:
+            print(self.cache.summary())
+        return [result for task in tasks for result in task.result()]
+
+    def run(self, locations, build_request, reduce_stack, column, accept=None, on_result=None,
+            desc="Fetching", tile_deg=TILE_DEG, checkpoint=None):
+        """
+        Extract one value per location.
+
+        locations: DataFrame with 'name', 'latitude' and 'longitude' columns
+        build_request: function (lat, lon) -> Process API payload
+        reduce_stack: module level function (stack, bboxes) -> values, called
+            in a worker process once per tile with the (N, H, W) stack of the
+            windows of its locations, or with a dict of stacks keyed by
+            response identifier for multi-response requests, and the (N, 4)
+            bboxes of the windows; returns an (N,) array of values
+        column: name of the result column, or a list of names when
+            reduce_stack returns a dict with one (N,) array per column
+        accept: optional Accept header, e.g. "application/tar" for
+            requests with several responses
+        on_result: optional callback invoked with each result as it completes
+        tile_deg: size of the grid cells used to batch nearby locations into
+            one request, None to request every location separately
+        checkpoint: optional CheckpointStore; locations already in it are not
+            requested again and new results are added to it
+
+        Returns a list of {'name', 'latitude', 'longitude', column} dicts in the
+        order of `locations`. Failed locations get a value of None.
+        """
+        rows = locations[["name", "latitude", "longitude"]].to_dict("records")
+        if not rows:
+            return []
+
+        # The window size is taken from the request of a single location
+        sample = build_request(rows[0]["latitude"], rows[0]["longitude"])
+        bbox = sample["input"]["bounds"]["bbox"]
+        buffer_deg = (bbox[2] - bbox[0]) / 2
+        window_px = sample["output"]["width"]
+
+        # Tiles are planned over all locations so they stay the same across
+        # resumed runs; only tiles with unfinished locations are requested
+        tiles = plan_tiles(rows, buffer_deg, window_px, tile_deg=tile_deg)
+        if checkpoint is not None:
+            tiles = [
+                tile for tile in tiles
+                if any(location_key(row["latitude"], row["longitude"]) not in checkpoint for row, _, _ in tile.members)
+            ]
+
+            def record(result, callback=on_result):
+                with self.metrics.timer("checkpoint"):
+                    checkpoint.add(result)
+                if callback is not None:
+                    callback(result)
+            on_result = record
+
+        print(f"Planned {len(tiles)} requests for {len(rows)} locations.")
+        try:
+            results = asyncio.run(self._run(tiles, build_request, reduce_stack, column, accept, on_result, desc))
+        finally:
+            if checkpoint is not None:
+                with self.metrics.timer("checkpoint"):
+                    checkpoint.flush()
+            self.metrics.report()
+            self.metrics.export()
+
+        # Results come in tile order. Successful results are also in the
+        # checkpoint, including those from earlier runs; failed ones only
+        # exist in this run's results
+        fetched = {location_key(r["latitude"], r["longitude"]): r for r in results}
+        ordered = []
+        for row in rows:
+            key = location_key(row["latitude"], row["longitude"])
+            result = (checkpoint.get(key) if checkpoint is not None else None) or fetched.get(key) or {}
+            ordered.append({**result, **row})
+        return ordered
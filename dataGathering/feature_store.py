@@ -0,0 +1,269 @@
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from checkpoint_store import coordinate_keys
+from paths import DATA_DIR
+
+FEATURE_STORE_PATH = os.path.join(DATA_DIR, "features")
+SERIES_STORE_PATH = os.path.join(DATA_DIR, "series")
+LOCATION_COLUMNS = ["name", "latitude", "longitude"]
+MAX_PARTS = 16  # parts per extractor before they are compacted into one
+
+
+def _extractor_dir(extractor, root):
+    return os.path.join(root, f"extractor={extractor}")
+
+
+def _parts(extractor, root):
+    # Part names start with the write time, so sorting gives the append order
+    return sorted(glob.glob(os.path.join(_extractor_dir(extractor, root), "part-*.parquet")))
+
+
+def extractors(root=FEATURE_STORE_PATH):
+    """
+    Names of the extractors with features in the store.
+    """
+    names = [os.path.basename(d).split("=", 1)[1] for d in glob.glob(os.path.join(root, "extractor=*"))]
+    return sorted(name for name in names if _parts(name, root))
+
+
+def _to_table(df):
+    """
+    Arrow table of a feature DataFrame: int64 location key, location columns
+    and float32 features.
+    """
+    df = df.reset_index(drop=True)
+    features = [c for c in df.columns if c not in LOCATION_COLUMNS and c != "location_key"]
+    arrays = {
+        "location_key": pa.array(coordinate_keys(df["latitude"], df["longitude"]), pa.int64()),
+        "name": pa.array(df["name"].astype(object).where(df["name"].notna(), None), pa.string()),
+        "latitude": pa.array(df["latitude"].to_numpy(dtype=np.float64)),
+        "longitude": pa.array(df["longitude"].to_numpy(dtype=np.float64)),
+    }
+    for column in features:
+        arrays[column] = pa.array(pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float32))
+    return pa.table(arrays)
+
+
+def _write_part(table, extractor, root):
+    directory = _extractor_dir(extractor, root)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{time.time_ns()}.parquet")
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def read_features(extractor, columns=None, root=FEATURE_STORE_PATH, memory_map=False):
+    """
+    Read the features of one extractor, indexed by location key.
+
+    columns: feature and location columns to read, None for all; only these
+        columns are read from disk
+    memory_map: memory-map the Parquet files instead of reading them
+
+    When a location was appended several times the values of the latest
+    part win; within one part the first row of a location wins, as when the
+    part was appended.
+    """
+    parts = _parts(extractor, root)
+    if not parts:
+        return pd.DataFrame(index=pd.Index([], dtype="int64", name="location_key"))
+
+    tables = []
+    for part in parts:
+        # Parts written before a column was added simply lack it
+        read_columns = None if columns is None else [
+            c for c in ["location_key", *columns] if c in pq.read_schema(part).names
+        ]
+        tables.append(pq.read_table(part, columns=read_columns, memory_map=memory_map))
+    table = pa.concat_tables(tables, promote_options="default")
+    df = table.to_pandas().set_index("location_key")
+    part_ids = np.repeat(np.arange(len(tables)), [t.num_rows for t in tables])
+    first_in_part = ~pd.DataFrame({"key": df.index.to_numpy(), "part": part_ids}).duplicated().to_numpy()
+    df = df[first_in_part]
+    return df[~df.index.duplicated(keep="last")]
+
+
+def compact(extractor, root=FEATURE_STORE_PATH):
+    """
+    Rewrite all parts of an extractor into one, keeping the latest values per location.
+    """
+    parts = _parts(extractor, root)
+    if len(parts) <= 1:
+        return
+    df = read_features(extractor, root=root).reset_index()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    _write_part(table, extractor, root)
+    for part in parts:
+        os.remove(part)
+
+
+def append_features(extractor, df, root=FEATURE_STORE_PATH):
+    """
+    Append extraction results to the store.
+
+    df: DataFrame with 'name', 'latitude', 'longitude' and the feature columns
+        of the extractor
+
+    Only locations that are new, or whose values changed, are written, as a
+    new part file. Of duplicate rows for a location in `df` the first wins. Parts are compacted once there are more than MAX_PARTS.
+    Returns the number of rows written.
+    """
+    table = _to_table(df)
+    new = table.to_pandas().drop_duplicates("location_key", keep="first").set_index("location_key")
+
+    existing = read_features(extractor, columns=list(new.columns), root=root)
+    if len(existing):
+        common = new.index.intersection(existing.index)
+        old = existing.reindex(index=common, columns=new.columns)
+        same = ((new.loc[common] == old) | (new.loc[common].isna() & old.isna())).all(axis=1)
+        new = new.drop(same.index[same])
+
+    if len(new):
+        _write_part(_to_table(new.reset_index(drop=True)), extractor, root)
+        if len(_parts(extractor, root)) > MAX_PARTS:
+            compact(extractor, root)
+    return len(new)
+
+
+def read_feature_table(columns=None, extractor_names=None, root=FEATURE_STORE_PATH, memory_map=False):
+    """
+    Join the features of several extractors into one table, one row per location.
+
+    columns: feature columns to include, None for all
+    extractor_names: extractors to read, in column order; defaults to all
+
+    Name and coordinates are taken from the first extractor that has the
+    location. Only the requested columns are read from disk.
+    """
+    frames = []
+    for extractor in extractor_names or extractors(root):
+        parts = _parts(extractor, root)
+        available = dict.fromkeys(c for part in parts for c in pq.read_schema(part).names)
+        wanted = [c for c in available if c not in LOCATION_COLUMNS and c != "location_key"
+                  and (columns is None or c in columns)]
+        if parts and (wanted or columns is None):
+            frames.append(read_features(extractor, LOCATION_COLUMNS + wanted, root, memory_map))
+
+    if not frames:
+        return pd.DataFrame(columns=LOCATION_COLUMNS)
+    locations = pd.concat([df[LOCATION_COLUMNS] for df in frames]).groupby(level=0, sort=False).first()
+    features = [df.drop(columns=LOCATION_COLUMNS) for df in frames]
+    return pd.concat([locations, *features], axis=1, join="outer")
+
+
+def _series_table(df):
+    """
+    Arrow table of a long-format series: int64 location key, interval start
+    date and float32 statistics, sorted by location and date.
+    """
+    statistics = [c for c in df.columns if c not in LOCATION_COLUMNS and c not in ("location_key", "date")]
+    keys = (df["location_key"].to_numpy(dtype=np.int64) if "location_key" in df.columns
+            else coordinate_keys(df["latitude"], df["longitude"]))
+    arrays = {
+        "location_key": pa.array(keys, pa.int64()),
+        "date": pa.array(pd.to_datetime(df["date"]).dt.date, pa.date32()),
+    }
+    for column in statistics:
+        arrays[column] = pa.array(pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float32))
+    return pa.table(arrays).sort_by([("location_key", "ascending"), ("date", "ascending")])
+
+
+def read_series(extractor, columns=None, start=None, end=None, root=SERIES_STORE_PATH, memory_map=False):
+    """
+    Read the time series of one extractor as a long DataFrame with
+    'location_key', 'date' and the statistics columns, one row per location
+    and interval.
+
+    columns: statistics columns to read, None for all
+    start, end: optional first and last interval dates to read, pushed down
+        to the Parquet row groups
+
+    When a location was appended several times its latest series wins.
+    """
+    filters = [("date", op, pd.Timestamp(value).date()) for op, value in ((">=", start), ("<=", end))
+               if value is not None]
+    parts = _parts(extractor, root)
+    if not parts:
+        return pd.DataFrame(columns=["location_key", "date", *(columns or [])])
+
+    # The newest part holding a location is found on the unfiltered keys, so a
+    # date range never brings back rows of a replaced series
+    latest = {}
+    for i, part in enumerate(parts):
+        latest.update(dict.fromkeys(pq.read_table(part, columns=["location_key"])["location_key"].to_pylist(), i))
+
+    frames = []
+    for i, part in enumerate(parts):
+        read_columns = None if columns is None else [
+            c for c in ["location_key", "date", *columns] if c in pq.read_schema(part).names
+        ]
+        df = pq.read_table(part, columns=read_columns, filters=filters or None, memory_map=memory_map).to_pandas()
+        frames.append(df[df["location_key"].map(latest).to_numpy() == i])
+    return pd.concat(frames, ignore_index=True)
+
+
+def append_series(extractor, df, root=SERIES_STORE_PATH):
+    """
+    Append long-format time series to the store, one row per location and
+    interval.
+
+    df: DataFrame with 'latitude' and 'longitude' (or 'location_key'), 'date'
+        and the statistics columns, e.g. from statistical_api.extract_series
+
+    The rows of a location replace its earlier series. Only locations whose
+    series is new or changed are written, as a new part file.
+    Returns the number of rows written.
+    """
+    table = _series_table(df)
+    new = table.to_pandas()
+
+    existing = read_series(extractor, columns=[c for c in new.columns if c not in ("location_key", "date")],
+                           root=root)
+    if len(existing) and len(new):
+        # Order independent content hash of every location's rows
+        def location_hashes(frame):
+            rows = pd.util.hash_pandas_object(frame[new.columns], index=False)
+            return rows.groupby(frame["location_key"].to_numpy()).sum()
+
+        old_hashes = location_hashes(existing.astype(new.dtypes.to_dict()))
+        new_hashes = location_hashes(new)
+        same = new_hashes.index[new_hashes.eq(old_hashes.reindex(new_hashes.index))]
+        new = new[~new["location_key"].isin(same)]
+
+    if len(new):
+        _write_part(_series_table(new), extractor, root)
+        if len(_parts(extractor, root)) > MAX_PARTS:
+            compact_series(extractor, root)
+    return len(new)
+
+
+def compact_series(extractor, root=SERIES_STORE_PATH):
+    """
+    Rewrite all series parts of an extractor into one, keeping the latest series per location.
+    """
+    parts = _parts(extractor, root)
+    if len(parts) <= 1:
+        return
+    _write_part(_series_table(read_series(extractor, root=root)), extractor, root)
+    for part in parts:
+        os.remove(part)
+
+
+def series_features(extractor, column="mean", root=SERIES_STORE_PATH):
+    """
+    Monthly features from a series: one `column` value per location and
+    month, averaged over the intervals starting in the month, in columns
+    named like 'ndvi_2024_05'. Indexed by location key.
+    """
+    df = read_series(extractor, [column], root=root)
+    months = pd.to_datetime(df["date"]).dt.strftime(f"{extractor}_%Y_%m")
+    return df.pivot_table(index="location_key", columns=months, values=column, aggfunc="mean").rename_axis(
+        columns=None
+    )
@@ -1,52 +1,82 @@
 import pandas as pd
 import os
+from checkpoint_store import coordinate_keys
+from feature_store import append_features, extractors, read_feature_table
+from incremental import location_changes, patch_table, save_snapshot
+from locations import LOCATIONS_PATH
+from paths import RESULTS_DIR, result_path
+
+# Extractors in column order, with the CSV results imported into the feature
+# store when the extractor has not written to it yet
+FEATURE_FILES = {
+    "ndvi": result_path('hydropower_ndvi.csv'),
+    "discharge": result_path('average_discharge.csv'),
+    "ndwi": result_path('hydropower_ndwi.csv'),
+    "precipitation": result_path('hydropower_precipitation.csv'),
+    "slope": result_path('hydropower_slopes.csv'),
+    "ndbi": result_path('hydropower_ndbi.csv'),
+    "mndwi": result_path('hydropower_mndwi.csv'),
+}
+# Row order of the table, as the outer merge of the CSVs used to sort it.
+# Imported CSVs are sorted the same way, so of several plants sharing
+# coordinates the same one keeps them
+ROW_ORDER = ['name', 'latitude', 'longitude']
 
 def main():
     """
     Main function to execute the script.
     """
-    
-    ndvi_df = pd.read_csv('../data/results/hydropower_ndvi.csv', low_memory=False)
-    discharge_df = pd.read_csv('../data/results/average_discharge.csv', low_memory=False)
-    ndwi_df = pd.read_csv('../data/results/hydropower_ndwi.csv', low_memory=False)
-    precipitation_df = pd.read_csv('../data/results/hydropower_precipitation.csv', low_memory=False)
-    slope_df = pd.read_csv('../data/results/hydropower_slopes.csv', low_memory=False)
-    ndbi_df = pd.read_csv('../data/results/hydropower_ndbi.csv', low_memory=False)
-    mndwi_df = pd.read_csv('../data/results/hydropower_mndwi.csv', low_memory=False)
-
-    print(f"NDVI DataFrame shape: {ndvi_df.shape}")
-    print(f"Discharge DataFrame shape: {discharge_df.shape}")
-    print(f"NDWI DataFrame shape: {ndwi_df.shape}")
-    print(f"Precipitation DataFrame shape: {precipitation_df.shape}")
-    print(f"Slope DataFrame shape: {slope_df.shape}")
-    print(f"NDBI DataFrame shape: {ndbi_df.shape}")
-    print(f"MNDWI DataFrame shape: {mndwi_df.shape}")
-
-    for df in [ndvi_df, discharge_df, ndwi_df, precipitation_df, slope_df, ndbi_df, mndwi_df]:
-        df["latitude"] = df["latitude"].round(6)
-        df["longitude"] = df["longitude"].round(6)
-
-    # Merge all DataFrames on 'latitude' and 'longitude'
-    df = ndvi_df.merge(discharge_df, on=['name', 'latitude', 'longitude'], how='outer')\
-            .merge(ndwi_df, on=['name', 'latitude', 'longitude'], how='outer')\
-            .merge(precipitation_df, on=['name', 'latitude', 'longitude'], how='outer')\
-            .merge(slope_df, on=['name', 'latitude', 'longitude'], how='outer')\
-            .merge(ndbi_df, on = ['name', 'latitude', 'longitude'], how = 'outer')\
-            .merge(mndwi_df, on = ['name', 'latitude', 'longitude'], how = 'outer')
-
-    df = df.drop_duplicates(subset=['latitude', 'longitude'], keep='first')
+
+    stored = extractors()
+    for extractor, path in FEATURE_FILES.items():
+        if extractor not in stored and os.path.exists(path):
+            results = pd.read_csv(path, low_memory=False)
+            results = results.sort_values(ROW_ORDER, na_position='last', kind='stable')
+            written = append_features(extractor, results)
+            print(f"Imported {written} {extractor} rows from {path}")
+
+    # One row per location, all features joined on the integer location key
+    df = read_feature_table(extractor_names=list(FEATURE_FILES))
+
+    df['latitude'] = df['latitude'].round(6)
+    df['longitude'] = df['longitude'].round(6)
 
     # add 'label' column based on 'name' if 'name' is not null
-    df['label'] = df['name'].apply(lambda x: 1 if pd.notnull(x) else 0)
+    df['label'] = df['name'].notna().astype('int8')
+    df = df.sort_values(ROW_ORDER, na_position='last', kind='stable')
 
-    print(f"Final DataFrame shape: {df.shape}")
+    # Only keep the locations of the current registry, so removed and moved
+    # locations drop out of the table
+    registry = pd.read_parquet(LOCATIONS_PATH) if os.path.exists(LOCATIONS_PATH) else None
+    if registry is not None:
+        changes = location_changes(registry)
+        print(", ".join(f"{len(rows)} {kind}" for kind, rows in changes.items()) + " locations since the last build")
+        df = df[df.index.isin(coordinate_keys(registry['latitude'], registry['longitude']))]
 
     # Create the output directory if it doesn't exist
-    output_dir = '../data/results'
+    output_dir = RESULTS_DIR
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    df.to_csv(os.path.join(output_dir, 'final_data.csv'), index=False)
+    # Patch the previous table instead of replacing it, and only rewrite it
+    # when rows changed. The CSV and Parquet copies are always written
+    # together, so they describe the same table
+    table_path = os.path.join(output_dir, 'final_data.parquet')
+    csv_path = os.path.join(output_dir, 'final_data.csv')
+    previous = None
+    if os.path.exists(table_path):
+        previous = pd.read_parquet(table_path)
+        previous.index = pd.Index(coordinate_keys(previous['latitude'], previous['longitude']), name='location_key')
+    df, summary = patch_table(previous, df)
+    print(f"Final DataFrame shape: {df.shape} ({summary['new']} new, {summary['changed']} changed, "
+          f"{summary['removed']} removed rows)")
+
+    if previous is None or any(summary.values()) or not os.path.exists(csv_path):
+        df.to_csv(csv_path, index=False)
+        # Columnar copy with float32 features, for reading only the needed columns
+        df.to_parquet(table_path, index=False)
+    if registry is not None:
+        save_snapshot(registry)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,102 +1,233 @@
-from time import sleep
+import json
+import sys
+import time
+import numpy as np
 import pandas as pd
 import requests
 from locations import get_hydropower_locations, get_locations
+from checkpoint_store import CheckpointStore, location_key
+from rate_limiter import SharedRateLimiter, parse_retry_after
+from response_cache import ResponseCache, make_key
 from tqdm import tqdm
+from feature_store import append_features
+from metrics import Metrics
+from paths import result_path
 
-def get_precipitation(lat, lon, start_date="2024-01-01", end_date="2024-12-31"):
+URL = "https://archive-api.open-meteo.com/v1/era5"
+
+BATCH_SIZE = 100  # coordinates per request
+ERA5_RESOLUTION = 0.25  # degrees
+SNAP_TO_GRID = True  # fetch each ERA5 grid cell once instead of every location
+# Local ERA5 precipitation cube (NetCDF or Zarr) to use instead of the Open-Meteo API,
+# can also be passed as the first command line argument
+ERA5_CUBE_PATH = None
+# Open-Meteo counts every coordinate as one call: stay below 5000 calls per hour
+# with bursts of up to 600 calls per minute
+CALLS_PER_SECOND = 5000 / 3600
+BURST_CALLS = 600
+MAX_THROTTLED_RETRIES = 5  # retries after 429 responses
+
+def open_meteo_limiter():
 	"""
-	Get precipitation data using Open-Meteo API
+	Limiter shared by every process calling the Open-Meteo API.
 	"""
-	url = "https://archive-api.open-meteo.com/v1/era5"
-	
-	params = {
-		"latitude": lat,
-		"longitude": lon,
+	return SharedRateLimiter(
+		"open_meteo", CALLS_PER_SECOND, BURST_CALLS, unit_rate=CALLS_PER_SECOND, unit_capacity=BURST_CALLS
+	)
+
+def precipitation_params(lats, lons, start_date, end_date):
+	return {
+		"latitude": ",".join(str(lat) for lat in lats),
+		"longitude": ",".join(str(lon) for lon in lons),
 		"start_date": start_date,
 		"end_date": end_date,
 		"daily": "precipitation_sum",
 		"timezone": "UTC"
 	}
-	
-	try:
-		response = requests.get(url, params=params, timeout=30)
-		response.raise_for_status()
-		
-		data = response.json()
-		
-		if "daily" in data and "precipitation_sum" in data["daily"]:
-			precip_values = data["daily"]["precipitation_sum"]
-			# Filter out None values and calculate mean
-			valid_precip = [p for p in precip_values if p is not None]
-			
-			if valid_precip:
-				return sum(valid_precip) / len(valid_precip)  # Mean daily precipitation
-		
-		return None
-		
-	except Exception as e:
-		print(f"Open-Meteo API error: {e}")
-		return None
-
-def main():
+
+def mean_daily_precipitation(responses):
+	"""
+	Mean daily precipitation of every location in a list of Open-Meteo responses.
+	Locations without any valid value get NaN.
+	"""
+	series = [r.get("daily", {}).get("precipitation_sum") or [] for r in responses]
+	daily = np.full((len(series), max(map(len, series), default=0)), np.nan)
+	for i, values in enumerate(series):
+		daily[i, :len(values)] = np.array(values, dtype=np.float64)
+
+	valid = ~np.isnan(daily)
+	counts = valid.sum(axis=1)
+	sums = np.where(valid, daily, 0).sum(axis=1)
+	return np.divide(sums, counts, out=np.full(len(responses), np.nan), where=counts > 0)
+
+def get_precipitation_batch(lats, lons, start_date="2024-01-01", end_date="2024-12-31", cache=None, limiter=None,
+							metrics=None, url=URL):
+	"""
+	Get mean daily precipitation for many locations with one Open-Meteo request.
+	Each location's response is cached under the same key as a single-location
+	request, so only locations missing from `cache` are requested. Stage times,
+	latencies and request counts are recorded in `metrics` if given.
+	Returns an array of means, with NaN for locations that failed.
+	"""
+	keys = [make_key(url, precipitation_params([lat], [lon], start_date, end_date)) for lat, lon in zip(lats, lons)]
+	responses = [None] * len(keys)
+
+	metrics = metrics or Metrics("precipitation")
+	if cache:
+		with metrics.timer("cache"):
+			for i, key in enumerate(keys):
+				content = cache.get(key)
+				if content is not None:
+					responses[i] = json.loads(content)
+		metrics.inc("cache_lookups", sum(r is not None for r in responses), result="hit")
+		metrics.inc("cache_lookups", sum(r is None for r in responses), result="miss")
+
+	missing = [i for i, r in enumerate(responses) if r is None]
+	if missing:
+		params = precipitation_params([lats[i] for i in missing], [lons[i] for i in missing], start_date, end_date)
+		try:
+			# Every coordinate counts as one call; throttled requests are
+			# retried once the shared limiter allows it
+			for _ in range(MAX_THROTTLED_RETRIES + 1):
+				with metrics.timer("rate_limit"):
+					lease = limiter.acquire(len(missing)) if limiter is not None else None
+				status = retry_after = None
+				start = time.perf_counter()
+				try:
+					response = requests.get(url, params=params, timeout=60)
+					status = response.status_code
+					retry_after = parse_retry_after(response.headers.get("Retry-After"))
+				finally:
+					latency = time.perf_counter() - start
+					metrics.add_time("http", latency)
+					metrics.observe("request_latency_seconds", latency)
+					if limiter is not None:
+						limiter.release(lease, status, retry_after)
+				metrics.inc("requests", status=status)
+				metrics.inc("locations_requested", len(missing))
+				if status != 429:
+					break
+				metrics.inc("throttled_retries")
+				if limiter is None:
+					time.sleep(retry_after or 1)
+			response.raise_for_status()
+			data = response.json()
+			# A single coordinate returns an object, several return a list
+			if isinstance(data, dict):
+				data = [data]
+
+			for i, location_data in zip(missing, data):
+				responses[i] = location_data
+				if cache:
+					cache.put(keys[i], json.dumps(location_data).encode("utf-8"))
+		except Exception as e:
+			print(f"Open-Meteo API error: {e}")
+			metrics.inc("errors", kind=type(e).__name__)
+
+	return mean_daily_precipitation([r or {} for r in responses])
+
+def get_precipitation(lat, lon, start_date="2024-01-01", end_date="2024-12-31", cache=None, limiter=None):
+	"""
+	Get precipitation data using Open-Meteo API
+	"""
+	value = get_precipitation_batch([lat], [lon], start_date, end_date, cache=cache, limiter=limiter)[0]
+	return None if np.isnan(value) else value
+
+def snap_to_era5_grid(lats, lons, resolution=ERA5_RESOLUTION):
+	"""
+	Snap coordinates to the centre of their ERA5 grid cell.
+	All locations in a cell get the same series from the archive API.
+	"""
+	cell_lats = np.round(np.round(np.asarray(lats, dtype=np.float64) / resolution) * resolution, 6)
+	cell_lons = np.round(np.round(np.asarray(lons, dtype=np.float64) / resolution) * resolution, 6)
+	return cell_lats, cell_lons
+
+def fetch_precipitation(lats, lons, cache=None, limiter=None, metrics=None, url=URL):
+	"""
+	Mean daily precipitation for many coordinates, fetched in batches.
+	Returns an array with NaN for coordinates that failed.
+	"""
+	lats, lons = list(lats), list(lons)
+	values = np.full(len(lats), np.nan)
+
+	with tqdm(total=len(lats), desc="Fetching precipitation") as pbar:
+		for start in range(0, len(lats), BATCH_SIZE):
+			batch = slice(start, start + BATCH_SIZE)
+			values[batch] = get_precipitation_batch(lats[batch], lons[batch], cache=cache, limiter=limiter, metrics=metrics,
+													url=url)
+
+			failed = np.flatnonzero(np.isnan(values[batch])) + start
+			if len(failed):
+				print(f"Failed to fetch precipitation data for {len(failed)} locations. Retrying...")
+				values[failed] = get_precipitation_batch(
+					[lats[i] for i in failed], [lons[i] for i in failed], cache=cache, limiter=limiter, metrics=metrics,
+					url=url
+				)
+			pbar.update(len(lats[batch]))
+
+	return values
+
+def main(cube_path=ERA5_CUBE_PATH):
 	locations = get_locations()
 	locations["latitude"] = locations["latitude"].round(6)
 	locations["longitude"] = locations["longitude"].round(6)
 
-	#load intermediate results if available
-	try:
-		inter_precip_df = pd.read_csv("data/intermediary/precipitation_intermediate.csv")
-		inter_precip_df["latitude"] = inter_precip_df["latitude"].round(6)
-		inter_precip_df["longitude"] = inter_precip_df["longitude"].round(6)
-		print("Loaded intermediate precipitation results.")
-	except FileNotFoundError:
-		inter_precip_df = pd.DataFrame(columns=["name", "latitude", "longitude", "precipitation"])
-		print("No intermediate precipitation results found. Starting fresh.")
-
-	# Loop over plants and fetch precipitation
-	results = []
-	for _, row in tqdm(locations.iterrows(), total=len(locations), desc="Fetching precipitation"):
-		
-		mask = (
-			(inter_precip_df['longitude'] == row['longitude']) &
-			(inter_precip_df['latitude'] == row['latitude'])
+	cache = ResponseCache()
+	config = {"cube": cube_path} if cube_path is not None else {"url": URL, "snap_to_grid": SNAP_TO_GRID}
+	store = CheckpointStore("precipitation", config=config)
+	limiter = open_meteo_limiter()
+	metrics = Metrics("precipitation")
+
+	done = [location_key(lat, lon) in store for lat, lon in zip(locations["latitude"], locations["longitude"])]
+	pending = locations[~np.array(done, dtype=bool)]
+	print(f"{len(locations) - len(pending)} locations already processed, {len(pending)} remaining.")
+
+	if cube_path is not None:
+		# Imported here so the HTTP backend works without xarray installed
+		from era5_cube import mean_daily_precipitation
+
+		print(f"Sampling precipitation from {cube_path}")
+		with metrics.timer("cube_read"):
+			pending = pending.assign(precipitation=mean_daily_precipitation(
+				cube_path, pending["latitude"], pending["longitude"]
+			))
+	else:
+		if SNAP_TO_GRID:
+			cell_lats, cell_lons = snap_to_era5_grid(pending["latitude"], pending["longitude"])
+		else:
+			cell_lats, cell_lons = pending["latitude"].to_numpy(), pending["longitude"].to_numpy()
+		pending = pending.assign(cell_lat=cell_lats, cell_lon=cell_lons)
+
+		# Fetch every unique cell once, then broadcast the values to all its locations
+		cells = pending[["cell_lat", "cell_lon"]].drop_duplicates().reset_index(drop=True)
+		print(f"{len(pending)} locations fall into {len(cells)} unique cells.")
+		cells["precipitation"] = fetch_precipitation(
+			cells["cell_lat"], cells["cell_lon"], cache=cache, limiter=limiter, metrics=metrics
 		)
-		if mask.any():
-			print(f"Skipping {row['name']} at ({row['latitude']}, {row['longitude']}) as it already exists in intermediate results.")
-			results.append({
-				"name": row['name'],
-				"latitude": row['latitude'],
-				"longitude": row['longitude'],
-				"precipitation": inter_precip_df.loc[(inter_precip_df['longitude'] == row['longitude'])
-													& (inter_precip_df['latitude'] == row['latitude'])
-													, 'precipitation'].values[0]
-			})
-			continue
-
-		print(f"Processing {row['name']} at ({row['latitude']}, {row['longitude']})")
-		precip_val = get_precipitation(row['latitude'], row['longitude'])
-
-		if precip_val is None:
-			print(f"Failed to fetch precipitation data for {row['name']}. Retrying in 10 seconds...")
-			precip_val = get_precipitation(row['latitude'], row['longitude'])
-
-		sleep(1.2)
-		
-		results.append({
-			"name": row['name'],
-			"latitude": row['latitude'],
-			"longitude": row['longitude'],
-			"precipitation": precip_val
+		pending = pending.merge(cells, on=["cell_lat", "cell_lon"], how="left")
+
+	for name, lat, lon, value in zip(pending["name"], pending["latitude"], pending["longitude"], pending["precipitation"]):
+		store.add({
+			"name": name,
+			"latitude": lat,
+			"longitude": lon,
+			"precipitation": None if np.isnan(value) else value
 		})
 
-		if len(results) % 200 == 0 and len(results) > 0:
-			inter_precip_df = pd.DataFrame(results)
-			inter_precip_df.to_csv("data/intermediary/precipitation_intermediate.csv", index=False)
+	with metrics.timer("checkpoint"):
+		store.close()
+	metrics.report()
+	metrics.export()
 
-	precip_df = pd.DataFrame(results)
-	print(inter_precip_df)
-	precip_df.to_csv("data/results/hydropower_precipitation.csv", index=False)
+	precip_df = locations[["name", "latitude", "longitude"]].copy()
+	precip_df["precipitation"] = [
+		(store.get(location_key(lat, lon)) or {}).get("precipitation")
+		for lat, lon in zip(precip_df["latitude"], precip_df["longitude"])
+	]
+	print(precip_df)
+	print(cache.summary())
+	precip_df.to_csv(result_path("hydropower_precipitation.csv"), index=False)
+	append_features("precipitation", precip_df)
 	
 if __name__ == "__main__":
-	main()
+	main(sys.argv[1] if len(sys.argv) > 1 else ERA5_CUBE_PATH)
@@ -2,13 +2,18 @@ import geopandas as gpd
 import pandas as pd
 from shapely.geometry import Point
 from locations import get_hydropower_locations, get_locations
+from river_store import load_rivers
+from feature_store import append_features
+from paths import result_path
+from metrics import Metrics
 
-def get_average_discharge(locations_df):
+SEARCH_MARGIN = 50_000  # metres around the locations to load rivers from
+
+def get_average_discharge(locations_df, metrics=None):
     """
     Get average discharge values for rivers at specified locations.
     """
-    rivers = gpd.read_file("data/HydroRIVERS_v10_eu_shp/HydroRIVERS_v10_eu.shp").to_crs(epsg=3857)
-    
+    metrics = metrics or Metrics("discharge")
     locations_gdf = gpd.GeoDataFrame(
         locations_df,
         geometry=[Point(xy) for xy in zip(locations_df.longitude, locations_df.latitude)],
@@ -16,11 +21,18 @@ def get_average_discharge(locations_df):
     ).to_crs(epsg=3857)
     print(f"Found {len(locations_gdf)} locations.")
 
+    # Only read the river segments around the locations
+    minx, miny, maxx, maxy = locations_gdf.total_bounds
+    with metrics.timer("load_rivers"):
+        rivers = load_rivers(["DIS_AV_CMS"], bbox=(minx - SEARCH_MARGIN, miny - SEARCH_MARGIN,
+                                                   maxx + SEARCH_MARGIN, maxy + SEARCH_MARGIN))
+
     # Spatial join: nearest river for each location
-    locations_with_rivers = gpd.sjoin_nearest(
-        locations_gdf, rivers[["geometry", "DIS_AV_CMS"]],
-        how="left", distance_col="dist_to_river"
-    )
+    with metrics.timer("nearest_join"):
+        locations_with_rivers = gpd.sjoin_nearest(
+            locations_gdf, rivers[["geometry", "DIS_AV_CMS"]],
+            how="left", distance_col="dist_to_river"
+        )
 
     locations_with_rivers = locations_with_rivers.to_crs(epsg=4326)
 
@@ -36,8 +48,12 @@ def get_average_discharge(locations_df):
 
 def main():
     locations = get_locations()
-    discharge_df = get_average_discharge(locations)
-    discharge_df.to_csv("data/results/average_discharge.csv", index=False)
+    metrics = Metrics("discharge")
+    discharge_df = get_average_discharge(locations, metrics)
+    discharge_df.to_csv(result_path("average_discharge.csv"), index=False)
+    append_features("discharge", discharge_df)
+    metrics.report()
+    metrics.export()
     print("Average discharge values saved to data/results/average_discharge.csv")
 
 if __name__ == "__main__":
@@ -0,0 +1,26 @@
+import sys
+
+from locations import get_locations
+from feature_store import append_series
+from get_spectral_indices import INDICES, STATISTICS_REQUESTS
+from statistical_api import SERIES_INTERVAL, extract_series
+
+
+def main(interval=SERIES_INTERVAL, indices=INDICES):
+    """
+    Extract a time series of every spectral index per location, e.g. monthly
+    means for seasonal features, with one Statistical API request per
+    location and index whatever the number of intervals. The series are
+    stored in long format in the series store (see feature_store.py).
+    """
+    locations = get_locations()
+
+    for index in indices:
+        series = extract_series(index, locations, STATISTICS_REQUESTS[index], interval=interval,
+                                desc=f"Fetching {index.upper()} series")
+        written = append_series(index, series)
+        print(f"{index}: {len(series)} rows for {series[['latitude', 'longitude']].drop_duplicates().shape[0]} "
+              f"locations, {written} rows written")
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else SERIES_INTERVAL)
@@ -1,56 +1,29 @@
-import json
+import sys
 import pandas as pd
-import requests
 import numpy as np
-import rasterio
-import tempfile
-import time
-from tqdm import tqdm
 from locations import get_hydropower_locations, get_locations
+from checkpoint_store import CheckpointStore, location_key
+from dem_mosaic import read_dem_windows
+from extraction_engine import ExtractionEngine, MAX_CONCURRENCY
+from metrics import Metrics
+from slope_kernel import PERCENTILE, slope_statistics
+from feature_store import append_features
+from paths import result_path
 
-AUTH_URL = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
+# Local Copernicus DEM GeoTIFF/VRT mosaic to use instead of the Process API,
+# can also be passed as the first command line argument
+DEM_MOSAIC_PATH = None
 
-with open("client_info.json", "r") as f:
-    AUTH_DATA = json.load(f)
-
-print("Authenticating with Copernicus Data Space...")
-print(f"AuthData: {AUTH_DATA}")
-token_response = requests.post(AUTH_URL, data=AUTH_DATA)
-print(f"Token response: {token_response.status_code} {token_response.text}")
-ACCESS_TOKEN = token_response.json()["access_token"]
-HEADERS = {
-    "Authorization": f"Bearer {ACCESS_TOKEN}"
-}
-
-def refresh_token():
-    """
-    Refresh the access token using the refresh token
-    """
-    global ACCESS_TOKEN, HEADERS
-    
-    token_response = requests.post(AUTH_URL, data=AUTH_DATA)
-    print(f"Token response: {token_response.status_code} {token_response.text}")
-    ACCESS_TOKEN = token_response.json()["access_token"]
-    HEADERS = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}"
-    }
-
-    if token_response.status_code == 200:
-        new_token = token_response.json()
-        ACCESS_TOKEN = new_token["access_token"]
-        HEADERS["Authorization"] = f"Bearer {ACCESS_TOKEN}"
-        print("Token refreshed successfully.")
-    else:
-        print(f"Failed to refresh token: {token_response.status_code} {token_response.text}")
+BUFFER_DEG = 0.0045  # ~500 m at equator
+SLOPE_COLUMNS = ["slope_degrees", "slope_max", f"slope_p{PERCENTILE}"]
 
 def get_slope(lat, lon):
     """
+    Build the Process API request for the DEM patch around a location.
     Simplified version using only DEM data without water masking
-    Use this if the water masking version has issues
     """
     # Create bbox around the plant (~500m x 500m)
-    buffer_deg = 0.0045  # ~500 m at equator
-    bbox = [lon - buffer_deg, lat - buffer_deg, lon + buffer_deg, lat + buffer_deg]
+    bbox = [lon - BUFFER_DEG, lat - BUFFER_DEG, lon + BUFFER_DEG, lat + BUFFER_DEG]
     
     evalscript = """
     //VERSION=3
@@ -90,92 +63,56 @@ def get_slope(lat, lon):
         }
     }
     
-    resp = requests.post(
-        "https://sh.dataspace.copernicus.eu/api/v1/process",
-        headers=HEADERS,
-        json=payload
-    )
-    
-    if resp.status_code != 200:
-        print(f"Error {resp.status_code}: {resp.text}")
-        if resp.status_code == 401 and "expired" in resp.text:
-            refresh_token()
-        return None
-    
-    # Calculate slope from DEM
-    with tempfile.NamedTemporaryFile(suffix=".tiff") as tmpfile:
-        tmpfile.write(resp.content)
-        tmpfile.flush()
-        
-        with rasterio.open(tmpfile.name) as src:
-            dem_array = src.read(1)
-            dem_array = dem_array.astype(np.float32)
-            
-            # Handle nodata values
-            if src.nodata is not None:
-                dem_array[dem_array == src.nodata] = np.nan
-            
-            # Calculate slope
-            pixel_size = 30  # 30m resolution
-            dy, dx = np.gradient(dem_array, pixel_size)
-            slope_radians = np.arctan(np.sqrt(dx**2 + dy**2))
-            slope_degrees = np.degrees(slope_radians)
-            
-            # Return mean slope
-            return np.nanmean(slope_degrees)
-
-def main():
-    locations = get_locations()
-    
-    # Load intermediate results if available
-    try:
-        inter_slope_df = pd.read_csv("data/intermediary/slope_intermediate.csv")
-        print("Loaded intermediate slope results.")
-    except FileNotFoundError:
-        inter_slope_df = pd.DataFrame(columns=["name", "latitude", "longitude", "slope_degrees"])
-        print("No intermediate slope results found. Starting fresh.")
+    return payload
 
-    # Loop over plants and fetch slope
-    results = []
-    for _, row in tqdm(locations.iterrows(), total=len(locations), desc="Fetching slope values"):
-        mask = (
-            (inter_slope_df['longitude'] == row['longitude']) &
-            (inter_slope_df['latitude'] == row['latitude'])
-        )
-        if mask.any():
-            print(f"Skipping {row['name']} as it already exists in intermediate results.")
-            results.append({
-                "name": row['name'],
-                "latitude": row['latitude'],
-                "longitude": row['longitude'],
-                "slope_degrees": inter_slope_df.loc[(inter_slope_df['longitude'] == row['longitude'])
-                                                    & (inter_slope_df['latitude'] == row['latitude'])
-                                                    , 'slope_degrees'].values[0]
-            })
-            continue
+def slopes_from_stack(dem_stack, bboxes):
+    """
+    Compute the mean, max and percentile slope in degrees of every window in
+    an (N, H, W) DEM stack at once, using each window's bbox for the ground
+    spacing of its pixels (see slope_kernel.py).
+    """
+    return slope_statistics(dem_stack, bboxes)
 
-        print(f"Processing {row['name']} at ({row['latitude']}, {row['longitude']})")
-        
-        slope_val = get_slope(row['latitude'], row['longitude'])
+def main(dem_path=DEM_MOSAIC_PATH):
+    locations = get_locations()
 
-        if slope_val is None:
-            print(f"Failed to fetch slope data for {row['name']}. Retrying...")
-            slope_val = get_slope(row['latitude'], row['longitude'])
+    config = {"request": get_slope(0, 0), "dem": dem_path, "columns": SLOPE_COLUMNS}
+    with CheckpointStore("slope", config=config) as store:
+        if dem_path is None:
+            engine = ExtractionEngine(max_concurrency=MAX_CONCURRENCY, metrics=Metrics("slope"))
+            results = engine.run(locations, get_slope, slopes_from_stack, SLOPE_COLUMNS,
+                                 checkpoint=store, desc="Fetching slope values")
+        else:
+            # Read windows from the local DEM instead of calling the Process API
+            keys = [location_key(lat, lon) for lat, lon in zip(locations["latitude"], locations["longitude"])]
+            pending = locations[[key not in store for key in keys]]
+            print(f"Reading {len(pending)} DEM windows from {dem_path}")
+            metrics = Metrics("slope")
 
-        results.append({
-            "name": row['name'],
-            "latitude": row['latitude'],
-            "longitude": row['longitude'],
-            "slope_degrees": slope_val
-        })
+            lats = pending["latitude"].to_numpy(dtype=np.float64)
+            lons = pending["longitude"].to_numpy(dtype=np.float64)
+            with metrics.timer("dem_read"):
+                stack = read_dem_windows(dem_path, lats, lons, buffer_deg=BUFFER_DEG)
+            bboxes = np.stack([lons - BUFFER_DEG, lats - BUFFER_DEG, lons + BUFFER_DEG, lats + BUFFER_DEG], axis=1)
+            with metrics.timer("reduce"):
+                slopes = slopes_from_stack(stack, bboxes)
+            with metrics.timer("checkpoint"):
+                for i, (name, lat, lon) in enumerate(zip(pending["name"], lats, lons)):
+                    store.add({"name": name, "latitude": lat, "longitude": lon,
+                               **{c: None if np.isnan(slopes[c][i]) else slopes[c][i] for c in SLOPE_COLUMNS}})
+            metrics.report()
+            metrics.export()
 
-        if len(results) % 200 == 0 and len(results) > 0:
-            inter_slope_df = pd.DataFrame(results)
-            inter_slope_df.to_csv("data/intermediary/slope_intermediate.csv", index=False)
+            results = [
+                {"name": name, "latitude": lat, "longitude": lon,
+                 **{c: (store.get(key) or {}).get(c) for c in SLOPE_COLUMNS}}
+                for name, lat, lon, key in zip(locations["name"], locations["latitude"], locations["longitude"], keys)
+            ]
 
     slope_df = pd.DataFrame(results)
     print(slope_df)
-    slope_df.to_csv("data/results/hydropower_slopes.csv", index=False)
+    slope_df.to_csv(result_path("hydropower_slopes.csv"), index=False)
+    append_features("slope", slope_df)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv[1] if len(sys.argv) > 1 else DEM_MOSAIC_PATH)
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+
+from locations import get_locations
+from checkpoint_store import CheckpointStore
+from extraction_engine import ExtractionEngine, MAX_CONCURRENCY
+from metrics import Metrics
+from feature_store import append_features
+from paths import result_path
+from statistical_api import extract_statistics
+from s2_local import S2_SCENES_DIR, extract_local_indices
+from index_extractor import BACKENDS, backend_args
+from get_mndwi_values import get_mndwi
+from get_ndbi_values import get_ndbi
+from get_ndvi_values import get_ndvi
+from get_ndwi_values import get_ndwi
+
+INDICES = ["ndvi", "ndwi", "ndbi", "mndwi"]
+# Request builders used by the Statistical API backend
+STATISTICS_REQUESTS = {"ndvi": get_ndvi, "ndwi": get_ndwi, "ndbi": get_ndbi, "mndwi": get_mndwi}
+# "process" for one multi-response Process API request per tile, "statistics"
+# for the Statistical API, "local" to compute them from local Sentinel-2 scenes
+# in S2_SCENES_DIR (see s2_local.py); can also be passed as the first command
+# line argument, followed by the scenes directory
+BACKEND = "process"
+
+
+def get_spectral_indices(lat, lon, start_date="2024-04-01", end_date="2024-09-30"):
+    """
+    Build one Process API request returning the temporal mean NDVI, NDWI, NDBI
+    and MNDWI around a location, each as its own response identifier.
+    """
+    buffer_deg = 0.0009
+    bbox = [lon - buffer_deg, lat - buffer_deg, lon + buffer_deg, lat + buffer_deg]
+
+    evalscript = """
+    //VERSION=3
+    function setup() {
+      return {
+        input: [{
+          bands: ["B03", "B04", "B08", "B11", "SCL"],
+          units: "DN"
+        }],
+        output: [
+          { id: "ndvi", bands: 1, sampleType: "FLOAT32" },
+          { id: "ndwi", bands: 1, sampleType: "FLOAT32" },
+          { id: "ndbi", bands: 1, sampleType: "FLOAT32" },
+          { id: "mndwi", bands: 1, sampleType: "FLOAT32" }
+        ],
+        mosaicking: "ORBIT"
+      };
+    }
+
+    function normalizedDifference(a, b) {
+      var value = (a - b) / (a + b);
+      return (!isNaN(value) && isFinite(value)) ? value : null;
+    }
+
+    function mean(values) {
+      if (values.length === 0) {
+        return NaN;
+      }
+      var sum = 0;
+      for (var j = 0; j < values.length; j++) {
+        sum += values[j];
+      }
+      return sum / values.length;
+    }
+
+    function evaluatePixel(samples) {
+      var ndvi = [], ndwi = [], ndbi = [], mndwi = [];
+
+      for (var i = 0; i < samples.length; i++) {
+        var sample = samples[i];
+        // Exclude cloud shadows, clouds, cirrus and snow
+        if ([3, 8, 9, 10, 11].includes(sample.SCL)) {
+          continue;
+        }
+
+        var value = normalizedDifference(sample.B03, sample.B08);
+        if (value !== null) ndwi.push(value);
+        value = normalizedDifference(sample.B11, sample.B08);
+        if (value !== null) ndbi.push(value);
+        value = normalizedDifference(sample.B03, sample.B11);
+        if (value !== null) mndwi.push(value);
+
+        // NDVI additionally excludes water pixels
+        if (sample.SCL == 6) {
+          continue;
+        }
+        value = normalizedDifference(sample.B08, sample.B04);
+        if (value !== null) ndvi.push(value);
+      }
+
+      return {
+        ndvi: [mean(ndvi)],
+        ndwi: [mean(ndwi)],
+        ndbi: [mean(ndbi)],
+        mndwi: [mean(mndwi)]
+      };
+    }
+    """
+
+    payload = {
+        "evalscript": evalscript,
+        "input": {
+            "bounds": {
+                "bbox": bbox
+            },
+            "data": [{
+                "type": "sentinel-2-l2a",
+                "dataFilter": {
+                    "timeRange": {
+                        "from": f"{start_date}T00:00:00Z",
+                        "to": f"{end_date}T23:59:59Z"
+                    },
+                    "maxCloudCoverPercentage": 10
+                },
+            }]
+        },
+        "output": {
+            "width": 50,
+            "height": 50,
+            "responses": [
+                {"identifier": index, "format": {"type": "image/tiff"}}
+                for index in INDICES
+            ]
+        }
+    }
+
+    return payload
+
+
+def spectral_indices_from_stacks(stacks, bboxes):
+    """
+    Compute the mean of every index for each window, from the stacks keyed by response identifier.
+    """
+    return {index: np.nanmean(stacks[index], axis=(1, 2)) for index in INDICES if index in stacks}
+
+
+def main(backend=BACKEND, scenes_dir=S2_SCENES_DIR):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    locations = get_locations()
+
+    if backend == "statistics":
+        # The Statistical API masks all outputs of an evalscript together, so
+        # every index is requested with its own single index evalscript
+        frames = [
+            pd.DataFrame(extract_statistics(index, locations, STATISTICS_REQUESTS[index],
+                                            desc=f"Fetching {index.upper()} statistics"))
+            for index in INDICES
+        ]
+        # Results come back in the order of `locations`, so the frames line up
+        location_columns = ["name", "latitude", "longitude"]
+        indices_df = pd.concat([frames[0][location_columns], *[df.drop(columns=location_columns) for df in frames]],
+                               axis=1)
+    elif backend == "local":
+        indices_df = pd.DataFrame(extract_local_indices("spectral_indices", locations, get_spectral_indices, INDICES,
+                                                        scenes_dir, desc="Computing spectral indices"))
+    else:
+        with CheckpointStore("spectral_indices", config=get_spectral_indices(0, 0)) as store:
+            engine = ExtractionEngine(max_concurrency=MAX_CONCURRENCY, metrics=Metrics("spectral_indices"))
+            results = engine.run(locations, get_spectral_indices, spectral_indices_from_stacks, INDICES,
+                                 accept="application/tar", checkpoint=store, desc="Fetching spectral indices")
+        indices_df = pd.DataFrame(results)
+    print(indices_df)
+
+    # Write one file and feature group per index, as the single index extractors do
+    for index in INDICES:
+        index_df = indices_df[["name", "latitude", "longitude",
+                               *[c for c in indices_df.columns if c == index or c.startswith(f"{index}_")]]]
+        index_df.to_csv(result_path(f"hydropower_{index}.csv"), index=False)
+        append_features(index, index_df)
+
+if __name__ == "__main__":
+    main(*backend_args())
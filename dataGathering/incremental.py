@@ -0,0 +1,73 @@
+import os
+
+import pandas as pd
+
+from checkpoint_store import coordinate_keys
+from paths import INTERMEDIARY_DIR
+
+LOCATIONS_SNAPSHOT = os.path.join(INTERMEDIARY_DIR, "locations_built.parquet")  # locations of the last built table
+
+
+def diff_locations(previous, current):
+    """
+    Compare two versions of the location registry by 'location_id'.
+
+    Returns a dict of DataFrames from `current` ('new' and 'moved', the
+    latter for locations whose coordinates changed) and from `previous`
+    ('removed').
+    """
+    previous = previous.set_index("location_id")
+    current = current.set_index("location_id")
+    common = current.index.intersection(previous.index)
+    moved = common[
+        coordinate_keys(current.loc[common, "latitude"], current.loc[common, "longitude"])
+        != coordinate_keys(previous.loc[common, "latitude"], previous.loc[common, "longitude"])
+    ]
+    return {
+        "new": current.loc[current.index.difference(previous.index)].reset_index(),
+        "removed": previous.loc[previous.index.difference(current.index)].reset_index(),
+        "moved": current.loc[moved].reset_index(),
+    }
+
+
+def location_changes(current, path=LOCATIONS_SNAPSHOT):
+    """
+    Changes of the registry since the last snapshot; every location is new
+    when there is none.
+    """
+    previous = pd.read_parquet(path) if os.path.exists(path) else current.iloc[:0]
+    return diff_locations(previous, current)
+
+
+def save_snapshot(locations, path=LOCATIONS_SNAPSHOT):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    locations.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+
+def patch_table(previous, current):
+    """
+    Patch the previously assembled table with the current rows, both indexed
+    by location key.
+
+    Rows are compared by content hash: removed locations are dropped, changed
+    rows replaced in place and new locations appended, so unchanged rows keep
+    their position. Returns the patched table and the number of new, changed
+    and removed rows.
+    """
+    if previous is None:
+        return current, {"new": len(current), "changed": 0, "removed": 0}
+
+    previous = previous.reindex(columns=current.columns)
+    removed = previous.index.difference(current.index)
+    new = current.index.difference(previous.index)
+    common = current.index.intersection(previous.index)
+
+    old_hashes = pd.util.hash_pandas_object(previous.loc[common].astype(current.dtypes.to_dict()), index=True)
+    new_hashes = pd.util.hash_pandas_object(current.loc[common], index=True)
+    changed = common[old_hashes.to_numpy() != new_hashes.to_numpy()]
+
+    patched = previous.drop(removed)
+    patched.loc[changed] = current.loc[changed]
+    patched = pd.concat([patched, current.loc[new]])
+    return patched, {"new": len(new), "changed": len(changed), "removed": len(removed)}
@@ -0,0 +1,64 @@
+import sys
+
+import pandas as pd
+
+from checkpoint_store import CheckpointStore
+from extraction_engine import ExtractionEngine, MAX_CONCURRENCY
+from feature_store import append_features
+from metrics import Metrics
+from paths import result_path
+from s2_local import S2_SCENES_DIR, extract_local_indices
+from statistical_api import extract_statistics
+
+# "process" to reduce Process API rasters locally, "statistics" to get the
+# aggregates from the Statistical API, "local" to compute the index from local
+# Sentinel-2 scenes in S2_SCENES_DIR (see s2_local.py); can also be passed as
+# the first command line argument of the index extractors, followed by the
+# scenes directory
+BACKEND = "process"
+BACKENDS = ("process", "statistics", "local")
+
+
+def backend_args(argv=None):
+    """
+    Backend and scenes directory from the command line of an index
+    extractor: `python get_ndvi_values.py [backend [scenes_dir]]`.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    return (argv[0] if len(argv) > 0 else BACKEND, argv[1] if len(argv) > 1 else S2_SCENES_DIR)
+
+
+def run_index(index, locations, build_request, reduce_stack, backend=BACKEND, scenes_dir=S2_SCENES_DIR):
+    """
+    Extract one spectral index per location with the chosen backend, then
+    write data/results/hydropower_<index>.csv and append the results to the
+    feature store.
+
+    index: index name, e.g. "ndvi", also the evalscript output, the result
+        column and the checkpoint name
+    build_request: the index's Process API request builder (lat, lon) -> payload
+    reduce_stack: module level function reducing a stack of windows to one
+        value per window, for the Process API backend
+
+    Returns the results as a DataFrame in the order of `locations`.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+    label = index.upper()
+    if backend == "statistics":
+        results = extract_statistics(index, locations, build_request, desc=f"Fetching {label}")
+    elif backend == "local":
+        results = extract_local_indices(index, locations, build_request, [index], scenes_dir,
+                                        desc=f"Computing {label}")
+    else:
+        with CheckpointStore(index, config=build_request(0, 0)) as store:
+            engine = ExtractionEngine(max_concurrency=MAX_CONCURRENCY, metrics=Metrics(index))
+            results = engine.run(locations, build_request, reduce_stack, index, checkpoint=store,
+                                 desc=f"Fetching {label}")
+
+    df = pd.DataFrame(results)
+    print(df)
+    df.to_csv(result_path(f"hydropower_{index}.csv"), index=False)
+    append_features(index, df)
+    return df
@@ -1,13 +1,28 @@
+import hashlib
+import json
+import os
+
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from river_store import RIVERS_SHP, load_rivers
+from paths import DATA_DIR, INTERMEDIARY_DIR
+
+HYDROPOWER_CSV = os.path.join(DATA_DIR, "GloHydroRes_vs1.csv")
+LOCATIONS_PATH = os.path.join(INTERMEDIARY_DIR, "locations.parquet")
+LOCATIONS_VERSION = 2  # bump when the way locations are built changes
 
 def get_hydropower_locations():
     """
     Fetches hydropower plant data from the global power plant database.
     Filters for European countries and returns a DataFrame with plant names and locations.
     """
-    df = pd.read_csv('../data/GloHydroRes_vs1.csv', low_memory=False)
+    df = pd.read_csv(HYDROPOWER_CSV, low_memory=False)
+    # Stable ids: the number of the GloHydroRes ID, e.g. GHR00042 -> 42
+    df['location_id'] = df['ID'].str.extract(r'(\d+)', expand=False).astype('int64')
     df = df.rename(columns={
         'plant_lat': 'latitude',
         'plant_lon': 'longitude',
@@ -24,37 +39,34 @@ def get_hydropower_locations():
 
     hydro_europe_df = df[df['country'].isin(european_countries)]
 
-    powerplant_locations = hydro_europe_df[['name', 'latitude', 'longitude']]
+    powerplant_locations = hydro_europe_df[['location_id', 'name', 'latitude', 'longitude']]
     return powerplant_locations
 
+EXCLUSION_DISTANCE = 30_000  # metres around plants without negative samples
+
 def get_random_river_locations(sample_size=5000, random_state=42):
     """
     Generates random locations alongside rivers, outside hydropower plant exclusion zones.
     """
-    rivers = gpd.read_file("data/HydroRIVERS_v10_eu_shp/HydroRIVERS_v10_eu.shp")  # HydroSHEDS Europe shapefile
-    
-    # Filter rivers by discharge
-    filtered_rivers = rivers[(rivers["DIS_AV_CMS"] <= 10) & (rivers["DIS_AV_CMS"] >= 1.2)]
-    rivers = filtered_rivers
-
-    rivers = rivers.to_crs(epsg=3857)  # Project for distance calculations
+    # Rivers in EPSG:3857 for distance calculations, filtered by discharge while reading
+    rivers = load_rivers(["HYRIV_ID", "DIS_AV_CMS"], filters=[("DIS_AV_CMS", ">=", 1.2), ("DIS_AV_CMS", "<=", 10)])
     powerplant_locations = get_hydropower_locations()
 
     # Load hydropower plants
     plants_gdf = gpd.GeoDataFrame(
         powerplant_locations,
-        geometry=[Point(xy) for xy in zip(powerplant_locations.longitude, powerplant_locations.latitude)],
+        geometry=gpd.points_from_xy(powerplant_locations.longitude, powerplant_locations.latitude),
         crs="EPSG:4326"
     ).to_crs(epsg=3857)
 
-    # Create buffer around plants (30 km)
-    plants_buffer = plants_gdf.buffer(30_000)
-
-    # Merge buffers into one exclusion area
-    exclusion_zone = plants_buffer.union_all()
+    # Rivers within 30 km of any plant, found with the spatial index of the
+    # rivers instead of intersecting them with the union of all plant buffers
+    _, near_plant = rivers.sindex.query(plants_gdf.geometry, predicate="dwithin", distance=EXCLUSION_DISTANCE)
 
     # Keep only rivers outside exclusion zone
-    rivers_far = rivers[~rivers.intersects(exclusion_zone)]
+    excluded = np.zeros(len(rivers), dtype=bool)
+    excluded[near_plant] = True
+    rivers_far = rivers[~excluded]
     print(f"Found {len(rivers_far)} river segments outside exclusion zone.")
     rivers_far = rivers_far.to_crs(epsg=4326)
 
@@ -63,21 +75,104 @@ def get_random_river_locations(sample_size=5000, random_state=42):
     # uncomment the next line to save the sampled rivers to a shapefile
     # sampled_rivers.to_file("out/random_negative_rivers.shp")
 
-    sampled_rivers["first_coord"] = sampled_rivers.geometry.apply(
-        lambda geom: list(geom.coords)[0] if geom.geom_type == "LineString" 
-        else list(list(geom.geoms)[0].coords)[0]
-    )
-    
-    sampled_rivers[["longitude", "latitude"]] = pd.DataFrame(
-        sampled_rivers["first_coord"].tolist(),
-        index=sampled_rivers.index
-    )
-    return sampled_rivers[["latitude", "longitude"]]
+    # Start point of every segment, the first line of multi-part geometries
+    first_lines = shapely.get_geometry(sampled_rivers.geometry.values, 0)
+    start_points = shapely.get_coordinates(shapely.get_point(first_lines, 0))
+    sampled_rivers["longitude"] = start_points[:, 0]
+    sampled_rivers["latitude"] = start_points[:, 1]
+    # Stable ids: the HydroRIVERS segment id, far above the GloHydroRes numbers
+    sampled_rivers["location_id"] = sampled_rivers["HYRIV_ID"].astype("int64")
+    return sampled_rivers[["location_id", "latitude", "longitude"]]
 
 
-def get_locations():
+def build_locations(sample_size=5000, random_state=42):
+    """
+    Build the full location set: hydropower plants plus random river locations.
+    """
     powerplant_locations = get_hydropower_locations()
-    random_rivers = get_random_river_locations()
+    random_rivers = get_random_river_locations(sample_size, random_state)
     locations = pd.concat([powerplant_locations, random_rivers], ignore_index=True)
 
+    return locations
+
+
+def _input_paths():
+    shapefile_base = os.path.splitext(RIVERS_SHP)[0]
+    return [HYDROPOWER_CSV, RIVERS_SHP, shapefile_base + ".dbf"]
+
+
+def _file_stats(paths):
+    return {path: [os.path.getsize(path), os.path.getmtime(path)] for path in paths if os.path.exists(path)}
+
+
+def _inputs_hash(paths, sample_size, random_state):
+    """
+    Content hash of the input files and the parameters the locations are built with.
+    """
+    digest = hashlib.sha256(json.dumps([LOCATIONS_VERSION, sample_size, random_state]).encode())
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        digest.update(path.encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_registry_info(path):
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    return json.loads(metadata[b"locations"]) if b"locations" in metadata else None
+
+
+def _write_registry(df, path, info):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, b"locations": json.dumps(info).encode()})
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def get_locations(sample_size=5000, random_state=42, path=LOCATIONS_PATH, rebuild=False):
+    """
+    Load the location set shared by all extractors from the Parquet registry,
+    building it first if it is missing or its inputs changed.
+
+    Every location has a stable integer 'location_id'. The registry stores the
+    content hash of its inputs, available as `locations.attrs["version"]`, so
+    all feature files built from the same version use the same points.
+    Unchanged inputs are recognised from their size and modification time,
+    so loading an up to date registry does not rehash them.
+    """
+    paths = _input_paths()
+    stats = _file_stats(paths)
+    params = {"version": LOCATIONS_VERSION, "sample_size": sample_size, "random_state": random_state}
+    info = None if rebuild else _read_registry_info(path)
+
+    if info is not None and info["params"] != params:
+        info = None
+    if info is not None and info["stats"] != stats:
+        # Files were touched, only rebuild if their content changed
+        if info["hash"] == _inputs_hash(paths, sample_size, random_state):
+            info["stats"] = stats
+            _write_registry(pd.read_parquet(path), path, info)
+        else:
+            info = None
+
+    if info is None:
+        print("Building the location registry...")
+        locations = build_locations(sample_size, random_state)
+        info = {
+            "hash": _inputs_hash(paths, sample_size, random_state),
+            "stats": stats,
+            "params": params,
+        }
+        _write_registry(locations, path, info)
+        print(f"Saved {len(locations)} locations to {path}")
+
+    locations = pd.read_parquet(path)
+    locations.attrs["version"] = info["hash"]
     return locations
\ No newline at end of file
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from paths import DATA_DIR
+
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+# Directory for Prometheus text files, e.g. the node_exporter textfile
+# collector directory; no text files are written when unset
+PROMETHEUS_DIR = os.environ.get("PROMETHEUS_TEXTFILE_DIR")
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # seconds
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+class Metrics:
+    """
+    Instrumentation of one extractor run: per-stage timers, counters and
+    histograms, exported as a JSON summary and optionally as a Prometheus
+    text file.
+
+    Stage times are summed over all concurrent requests, so they show where
+    the work goes rather than adding up to the wall time. Safe to share
+    between threads and coroutines.
+    """
+
+    def __init__(self, name, directory=METRICS_DIR, prometheus_dir=PROMETHEUS_DIR, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.directory = directory
+        self.prometheus_dir = prometheus_dir
+        self.buckets = buckets
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stages = {}  # stage -> [seconds, calls]
+        self._counters = {}  # (counter, labels) -> value
+        self._histograms = {}  # histogram -> {"buckets", "counts", "sum", "count"}
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds, calls=1):
+        with self._lock:
+            total = self._stages.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += calls
+
+    def inc(self, counter, value=1, **labels):
+        key = (counter, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, histogram, value, buckets=None):
+        buckets = buckets or self.buckets
+        with self._lock:
+            hist = self._histograms.setdefault(
+                histogram, {"buckets": buckets, "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            )
+            index = next((i for i, bound in enumerate(hist["buckets"]) if value <= bound), len(hist["buckets"]))
+            hist["counts"][index] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    @staticmethod
+    def _quantile(hist, q):
+        """
+        Upper bound of the bucket holding the q-quantile.
+        """
+        target = q * hist["count"]
+        seen = 0
+        for bound, count in zip(hist["buckets"], hist["counts"]):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def summary(self):
+        """
+        Machine-readable summary of the run.
+        """
+        with self._lock:
+            histograms = {}
+            for name, hist in self._histograms.items():
+                cumulative, seen = {}, 0
+                for bound, count in zip([*hist["buckets"], "+Inf"], hist["counts"]):
+                    seen += count
+                    cumulative[str(bound)] = seen
+                histograms[name] = {
+                    "count": hist["count"],
+                    "sum": hist["sum"],
+                    "mean": hist["sum"] / hist["count"] if hist["count"] else None,
+                    "p50": self._quantile(hist, 0.5),
+                    "p90": self._quantile(hist, 0.9),
+                    "p99": self._quantile(hist, 0.99),
+                    "buckets": cumulative,
+                }
+            counters = {}
+            for (name, labels), value in sorted(self._counters.items()):
+                counters[f"{name}{{{_format_labels(labels)}}}" if labels else name] = value
+            return {
+                "extractor": self.name,
+                "started": self.started,
+                "wall_seconds": time.time() - self.started,
+                "stages": {stage: {"seconds": s, "calls": c} for stage, (s, c) in sorted(self._stages.items())},
+                "counters": counters,
+                "histograms": histograms,
+            }
+
+    def prometheus(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        extractor = f'extractor="{self.name}"'
+        lines = [
+            "# TYPE extraction_stage_seconds_total counter",
+            "# TYPE extraction_stage_calls_total counter",
+        ]
+        with self._lock:
+            for stage, (seconds, calls) in sorted(self._stages.items()):
+                lines.append(f'extraction_stage_seconds_total{{{extractor},stage="{stage}"}} {seconds}')
+                lines.append(f'extraction_stage_calls_total{{{extractor},stage="{stage}"}} {calls}')
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE extraction_{name}_total counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        label_text = ",".join(filter(None, [extractor, _format_labels(labels)]))
+                        lines.append(f"extraction_{name}_total{{{label_text}}} {value}")
+            for name, hist in sorted(self._histograms.items()):
+                lines.append(f"# TYPE extraction_{name} histogram")
+                seen = 0
+                for bound, count in zip([*hist["buckets"], "+Inf"], hist["counts"]):
+                    seen += count
+                    lines.append(f'extraction_{name}_bucket{{{extractor},le="{bound}"}} {seen}')
+                lines.append(f"extraction_{name}_sum{{{extractor}}} {hist['sum']}")
+                lines.append(f"extraction_{name}_count{{{extractor}}} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """
+        Print the stages sorted by time, plus the counters.
+        """
+        summary = self.summary()
+        print(f"--- {self.name}: {summary['wall_seconds']:.1f} s wall time ---")
+        for stage, stats in sorted(summary["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            print(f"{stage:<16}{stats['seconds']:>10.2f} s{stats['calls']:>10} calls")
+        for name, value in summary["counters"].items():
+            print(f"{name:<40}{value:>12g}")
+        for name, hist in summary["histograms"].items():
+            print(f"{name}: {hist['count']} observations, p50 <= {hist['p50']}, p90 <= {hist['p90']}, "
+                  f"p99 <= {hist['p99']}")
+
+    def export(self, directory=None, prometheus_dir=None):
+        """
+        Write the summary to `directory`/<name>.json and, if `prometheus_dir`
+        is set, the Prometheus text file `prometheus_dir`/<name>.prom. Both
+        default to the directories the metrics were created with.
+        """
+        directory = directory or self.directory
+        prometheus_dir = prometheus_dir or self.prometheus_dir
+        for path, content in [
+            (os.path.join(directory, f"{self.name}.json"), json.dumps(self.summary(), indent=2)),
+            (os.path.join(prometheus_dir, f"{self.name}.prom") if prometheus_dir else None, self.prometheus()),
+        ]:
+            if path is None:
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        print(f"Metrics written to {os.path.join(directory, self.name + '.json')}")
@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import io
+import json
+import random
+import re
+import tarfile
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+from aiohttp import web
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+
+from extraction_engine import PU_HEADER, estimate_processing_units
+
+TOKEN_PATH = "/auth/realms/CDSE/protocol/openid-connect/token"
+PROCESS_PATH = "/api/v1/process"
+STATISTICS_PATH = "/api/v1/statistics"
+OPEN_METEO_PATH = "/v1/era5"
+
+
+def synthetic_field(lons, lats, dem=False):
+    """
+    Smooth, deterministic values for a grid of coordinates: index-like values
+    in [-1, 1], or elevations in metres for DEM requests.
+    """
+    values = 0.6 * np.sin(lons * 40.0) * np.cos(lats * 30.0) + 0.2 * np.sin((lons + lats) * 7.0)
+    return (values * 800 + 1200 if dem else values).astype(np.float32)
+
+
+def encode_tiff(array, bbox):
+    with MemoryFile() as memfile:
+        with memfile.open(driver="GTiff", width=array.shape[1], height=array.shape[0], count=1,
+                          dtype="float32", crs="EPSG:4326",
+                          transform=from_bounds(*bbox, array.shape[1], array.shape[0])) as dst:
+            dst.write(array, 1)
+        return memfile.read()
+
+
+def _intervals(time_range, interval):
+    """
+    Start and end dates of the aggregation intervals of a Statistical API request.
+    """
+    start = date.fromisoformat(time_range["from"][:10])
+    end = date.fromisoformat(time_range["to"][:10])
+    months = re.fullmatch(r"P(\d+)M", interval)
+    days = re.fullmatch(r"P(\d+)D", interval)
+    intervals = []
+    while start <= end:
+        if months:
+            month = start.month - 1 + int(months.group(1))
+            stop = date(start.year + month // 12, month % 12 + 1, 1)
+        else:
+            stop = start + timedelta(days=int(days.group(1)) if days else 1)
+        intervals.append((start, min(stop, end + timedelta(days=1))))
+        start = stop
+    return intervals
+
+
+class MockServers:
+    """
+    Local stand-ins for the Copernicus token endpoint, the Sentinel Hub
+    Process and Statistical APIs and the Open-Meteo archive API, for
+    measuring the extractors without spending quota.
+
+    Responses are synthetic but well formed: float32 GeoTIFFs (or tar
+    archives of them for multi-response requests) with values that vary
+    smoothly with the coordinates, statistics JSON per interval and daily
+    precipitation series. Every request waits a log-normally distributed
+    `latency` (median, seconds, with spread `jitter`), and fails with a
+    status from `error_rates` ({status: probability}, e.g. {429: 0.05,
+    503: 0.01}); 429 responses carry a Retry-After of `retry_after` seconds.
+    Tokens expire after `expires_in` seconds and Sentinel Hub requests with
+    unknown or expired tokens get a 401.
+
+    Runs in a background thread: use start()/stop() or a with block, then
+    point the extractors at auth_url, process_url, statistics_url and
+    open_meteo_url. `requests` counts the responses by (endpoint, status).
+    """
+
+    def __init__(self, latency=0.05, jitter=0.5, error_rates=None, retry_after=1, expires_in=600, seed=0,
+                 host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rates = error_rates or {}
+        self.retry_after = retry_after
+        self.expires_in = expires_in
+        self.host = host
+        self.port = port
+        self.requests = {}
+        self._random = random.Random(seed)
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def auth_url(self):
+        return self.base_url + TOKEN_PATH
+
+    @property
+    def process_url(self):
+        return self.base_url + PROCESS_PATH
+
+    @property
+    def statistics_url(self):
+        return self.base_url + STATISTICS_PATH
+
+    @property
+    def open_meteo_url(self):
+        return self.base_url + OPEN_METEO_PATH
+
+    def _count(self, endpoint, status):
+        with self._lock:
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+
+    def _reply(self, endpoint, response):
+        self._count(endpoint, response.status)
+        return response
+
+    async def _delay_and_fail(self, request, endpoint, authenticate=True):
+        """
+        Wait the simulated latency, then return an error response to inject, or None.
+        """
+        with self._lock:
+            delay = self._random.lognormvariate(0, self.jitter) * self.latency if self.latency else 0
+            draw = self._random.random()
+        await asyncio.sleep(delay)
+
+        if authenticate:
+            token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if self._tokens.get(token, 0) < time.monotonic():
+                return self._reply(endpoint, web.json_response({"error": "unauthorized"}, status=401))
+
+        cumulative = 0.0
+        for status, rate in sorted(self.error_rates.items()):
+            cumulative += rate
+            if draw < cumulative:
+                headers = {"Retry-After": str(self.retry_after)} if status == 429 else {}
+                return self._reply(endpoint, web.json_response({"error": f"injected {status}"}, status=status,
+                                                               headers=headers))
+        return None
+
+    async def _token(self, request):
+        await request.post()
+        token = f"mock-{len(self._tokens)}-{time.monotonic_ns()}"
+        self._tokens[token] = time.monotonic() + self.expires_in
+        return self._reply("token", web.json_response({"access_token": token, "expires_in": self.expires_in}))
+
+    async def _process(self, request):
+        error = await self._delay_and_fail(request, "process")
+        if error is not None:
+            return error
+        payload = await request.json()
+        bbox = payload["input"]["bounds"]["bbox"]
+        width, height = payload["output"]["width"], payload["output"]["height"]
+        res_x, res_y = (bbox[2] - bbox[0]) / width, (bbox[3] - bbox[1]) / height
+        lons = bbox[0] + (np.arange(width) + 0.5) * res_x
+        lats = bbox[3] - (np.arange(height) + 0.5) * res_y
+        dem = payload["input"]["data"][0]["type"] == "dem"
+        identifiers = [r["identifier"] for r in payload["output"]["responses"]]
+
+        headers = {PU_HEADER: f"{estimate_processing_units(payload):.4f}"}
+        if len(identifiers) == 1 and request.headers.get("Accept") != "application/tar":
+            array = synthetic_field(*np.meshgrid(lons, lats), dem=dem)
+            return self._reply("process", web.Response(body=encode_tiff(array, bbox), headers=headers,
+                                                       content_type="image/tiff"))
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for i, identifier in enumerate(identifiers):
+                # Shift the field per response so the outputs differ
+                array = synthetic_field(*np.meshgrid(lons + i * 0.01, lats), dem=dem)
+                content = encode_tiff(array, bbox)
+                info = tarfile.TarInfo(f"{identifier}.tif")
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        return self._reply("process", web.Response(body=archive.getvalue(), headers=headers,
+                                                   content_type="application/tar"))
+
+    async def _statistics(self, request):
+        error = await self._delay_and_fail(request, "statistics")
+        if error is not None:
+            return error
+        payload = await request.json()
+        aggregation = payload["aggregation"]
+        bbox = payload["input"]["bounds"]["bbox"]
+        outputs = [o for o in re.findall(r'id:\s*"(\w+)"', aggregation["evalscript"]) if o != "dataMask"]
+        percentiles = (payload.get("calculations", {}).get("default", {}).get("statistics", {})
+                       .get("default", {}).get("percentiles", {}).get("k", []))
+        pixels = aggregation["width"] * aggregation["height"]
+
+        intervals = _intervals(aggregation["timeRange"], aggregation["aggregationInterval"]["of"])
+        data = []
+        for i, (start, stop) in enumerate(intervals):
+            mean = float(synthetic_field(np.array([(bbox[0] + bbox[2]) / 2 + i * 0.01]),
+                                         np.array([(bbox[1] + bbox[3]) / 2]))[0])
+            stats = {"min": mean - 0.2, "max": mean + 0.2, "mean": mean, "stDev": 0.1,
+                     "sampleCount": pixels, "noDataCount": pixels // 10}
+            if percentiles:
+                stats["percentiles"] = {f"{float(k)}": mean + (k - 50) / 250 for k in percentiles}
+            data.append({
+                "interval": {"from": f"{start}T00:00:00Z", "to": f"{stop}T00:00:00Z"},
+                "outputs": {output: {"bands": {"B0": {"stats": stats}}} for output in outputs},
+            })
+        return self._reply("statistics", web.json_response({"data": data, "status": "OK"}))
+
+    async def _open_meteo(self, request):
+        error = await self._delay_and_fail(request, "open_meteo", authenticate=False)
+        if error is not None:
+            return error
+        query = request.query
+        lats = [float(v) for v in query["latitude"].split(",")]
+        lons = [float(v) for v in query["longitude"].split(",")]
+        start, end = date.fromisoformat(query["start_date"]), date.fromisoformat(query["end_date"])
+        days = [str(start + timedelta(days=i)) for i in range((end - start).days + 1)]
+
+        locations = []
+        for lat, lon in zip(lats, lons):
+            level = 2.5 + 2 * float(synthetic_field(np.array([lon]), np.array([lat]))[0])
+            values = np.clip(level + np.sin(np.arange(len(days)) / 5.0) * 2, 0, None).round(1)
+            locations.append({"latitude": lat, "longitude": lon,
+                              "daily": {"time": days, "precipitation_sum": values.tolist()}})
+        return self._reply("open_meteo", web.json_response(locations[0] if len(locations) == 1 else locations))
+
+    def _app(self):
+        app = web.Application(client_max_size=16 * 1024 ** 2)
+        app.router.add_post(TOKEN_PATH, self._token)
+        app.router.add_post(PROCESS_PATH, self._process)
+        app.router.add_post(STATISTICS_PATH, self._statistics)
+        app.router.add_get(OPEN_METEO_PATH, self._open_meteo)
+        return app
+
+    def start(self):
+        """
+        Start serving in a background thread; with port 0 a free port is picked.
+        """
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            runner = web.AppRunner(self._app(), access_log=None)
+            self._loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, self.host, self.port)
+            self._loop.run_until_complete(site.start())
+            self.port = runner.addresses[0][1]
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(runner.cleanup())
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve mock Sentinel Hub and Open-Meteo APIs.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.05, help="median latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="log-normal spread of the latency")
+    parser.add_argument("--unauthorized", type=float, default=0.0, help="rate of injected 401 responses")
+    parser.add_argument("--throttled", type=float, default=0.0, help="rate of injected 429 responses")
+    parser.add_argument("--server-errors", type=float, default=0.0, help="rate of injected 503 responses")
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--expires-in", type=int, default=600, help="token lifetime in seconds")
+    args = parser.parse_args(argv)
+
+    servers = MockServers(
+        args.latency, args.jitter, {401: args.unauthorized, 429: args.throttled, 503: args.server_errors},
+        args.retry_after, args.expires_in, port=args.port,
+    ).start()
+    print(json.dumps({"auth_url": servers.auth_url, "process_url": servers.process_url,
+                      "statistics_url": servers.statistics_url, "open_meteo_url": servers.open_meteo_url}, indent=2))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servers.stop()
+
+
+if __name__ == "__main__":
+    main()
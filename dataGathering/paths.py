@@ -0,0 +1,13 @@
+import os
+
+# All paths are resolved from the repository root, so the scripts work from
+# any working directory
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+RESULTS_DIR = os.path.join(DATA_DIR, "results")
+INTERMEDIARY_DIR = os.path.join(DATA_DIR, "intermediary")
+CLIENT_INFO_PATH = os.path.join(ROOT_DIR, "client_info.json")
+
+
+def result_path(filename):
+    return os.path.join(RESULTS_DIR, filename)
@@ -0,0 +1,164 @@
+import argparse
+import importlib
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from paths import ROOT_DIR
+
+# Stage name -> (module, function), stages it depends on and the shared
+# resources it uses. The extractors only depend on the location registry,
+# so they run in parallel.
+STAGES = {
+    "locations": ("locations", "get_locations", [], []),
+    "spectral_indices": ("get_spectral_indices", "main", ["locations"], ["sentinel_hub"]),
+    "slope": ("get_slope_values", "main", ["locations"], ["sentinel_hub"]),
+    "precipitation": ("get_daily_precip", "main", ["locations"], ["open_meteo"]),
+    "discharge": ("get_discharge", "main", ["locations"], []),
+    "final_data": ("final_data", "main", ["spectral_indices", "slope", "precipitation", "discharge"], []),
+    "train": ("pipeline", "train", ["final_data"], []),
+    # Not part of final_data, run it explicitly
+    "index_series": ("get_index_series", "main", ["locations"], ["sentinel_hub"]),
+}
+
+# Max number of stages using a resource at the same time
+RESOURCE_LIMITS = {
+    "sentinel_hub": 2,  # the processing unit budget is shared by the account
+    "open_meteo": 1,
+}
+
+
+def train(notebook=os.path.join(ROOT_DIR, "main.ipynb")):
+    """
+    Execute the training notebook in place.
+    """
+    subprocess.run(
+        [sys.executable, "-m", "jupyter", "nbconvert", "--to", "notebook", "--execute", "--inplace", notebook],
+        cwd=ROOT_DIR, check=True,
+    )
+
+
+def _run_stage(module, function, kwargs):
+    # Runs in a worker process
+    start = time.perf_counter()
+    getattr(importlib.import_module(module), function)(**kwargs)
+    return time.perf_counter() - start
+
+
+def required_stages(targets):
+    """
+    The target stages and everything they depend on, in dependency order.
+    """
+    order = []
+
+    def visit(name):
+        if name in order:
+            return
+        for dependency in STAGES[name][2]:
+            visit(dependency)
+        order.append(name)
+
+    for target in targets:
+        visit(target)
+    return order
+
+
+def run(targets=("final_data",), jobs=None, stage_kwargs=None):
+    """
+    Run the target stages and their dependencies.
+
+    Every stage runs in its own process as soon as its dependencies finished,
+    at most `jobs` at a time and within RESOURCE_LIMITS. When a stage fails,
+    the stages depending on it are skipped.
+    Returns a dict of stage -> (status, wall time in seconds).
+    """
+    stage_kwargs = stage_kwargs or {}
+    pending = required_stages(targets)
+    jobs = jobs or len(pending)
+    report = {}
+    running = {}
+    in_use = dict.fromkeys(RESOURCE_LIMITS, 0)
+    start = time.perf_counter()
+
+    def ready(name):
+        dependencies, resources = STAGES[name][2], STAGES[name][3]
+        return (all(report.get(d, (None,))[0] == "ok" for d in dependencies)
+                and all(in_use[r] < RESOURCE_LIMITS[r] for r in resources))
+
+    # Spawn so every stage starts from a clean interpreter
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+        while pending or running:
+            for name in list(pending):
+                if any(report.get(d, ("ok",))[0] != "ok" for d in STAGES[name][2]):
+                    pending.remove(name)
+                    report[name] = ("skipped", 0.0)
+                elif len(running) < jobs and ready(name):
+                    pending.remove(name)
+                    for resource in STAGES[name][3]:
+                        in_use[resource] += 1
+                    print(f"[pipeline] Starting {name}")
+                    module, function = STAGES[name][:2]
+                    running[pool.submit(_run_stage, module, function, stage_kwargs.get(name, {}))] = name
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                for resource in STAGES[name][3]:
+                    in_use[resource] -= 1
+                try:
+                    report[name] = ("ok", future.result())
+                except Exception as e:
+                    print(f"[pipeline] {name} failed: {e}")
+                    report[name] = ("failed", 0.0)
+                print(f"[pipeline] Finished {name}: {report[name][0]} in {report[name][1]:.1f} s")
+
+    total = time.perf_counter() - start
+    print(f"\n{'stage':<20}{'status':<10}{'wall time':>12}")
+    for name, (status, elapsed) in report.items():
+        print(f"{name:<20}{status:<10}{elapsed:>10.1f} s")
+    print(f"{'total':<30}{total:>10.1f} s (sum of stages {sum(e for _, e in report.values()):.1f} s)")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the hydropower data pipeline.")
+    parser.add_argument("targets", nargs="*", metavar="stage",
+                        help=f"stages to run, together with the stages they depend on: {', '.join(STAGES)} "
+                             "(default: final_data)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="max stages running at once")
+    parser.add_argument("--dem-mosaic", help="local Copernicus DEM mosaic for the slope stage")
+    parser.add_argument("--era5-cube", help="local ERA5 cube for the precipitation stage")
+    parser.add_argument("--statistical-api", action="store_true",
+                        help="get the spectral indices as aggregates from the Statistical API")
+    parser.add_argument("--s2-scenes", help="directory of local Sentinel-2 L2A scenes to compute the spectral "
+                                            "indices from instead of calling Sentinel Hub")
+    parser.add_argument("--series-interval",
+                        help="ISO 8601 interval of the index_series stage, e.g. P1M (default) or P1D")
+    args = parser.parse_args(argv)
+    unknown = [target for target in args.targets if target not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    stage_kwargs = {}
+    if args.dem_mosaic:
+        stage_kwargs["slope"] = {"dem_path": args.dem_mosaic}
+    if args.era5_cube:
+        stage_kwargs["precipitation"] = {"cube_path": args.era5_cube}
+    if args.statistical_api:
+        stage_kwargs["spectral_indices"] = {"backend": "statistics"}
+    if args.s2_scenes:
+        stage_kwargs["spectral_indices"] = {"backend": "local", "scenes_dir": args.s2_scenes}
+    if args.series_interval:
+        stage_kwargs["index_series"] = {"interval": args.series_interval}
+
+    report = run(args.targets or ["final_data"], args.jobs, stage_kwargs)
+    return 0 if all(status == "ok" for status, _ in report.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import io
+import tarfile
+import time
+
+import numpy as np
+from rasterio.io import MemoryFile
+
+TIFF_MAGIC = (b"II*\x00", b"MM\x00*")
+
+
+def read_tiff(content):
+    """
+    Read the first band of an in-memory TIFF as float32 with nodata set to NaN.
+    """
+    with MemoryFile(content) as memfile:
+        with memfile.open() as src:
+            arr = src.read(1).astype(np.float32)
+            if src.nodata is not None:
+                arr[arr == src.nodata] = np.nan
+            return arr
+
+
+def decode_response(content):
+    """
+    Decode a Process API response into an array, or into a dict of arrays
+    keyed by response identifier for multi-response (tar) responses.
+    """
+    if content[:4] in TIFF_MAGIC:
+        return read_tiff(content)
+
+    arrays = {}
+    with tarfile.open(fileobj=io.BytesIO(content)) as tar:
+        for member in tar.getmembers():
+            identifier = member.name.rsplit("/", 1)[-1].split(".")[0]
+            arrays[identifier] = read_tiff(tar.extractfile(member).read())
+    return arrays
+
+
+def window_bboxes(tile_bbox, tile_shape, offsets, window_px):
+    """
+    Geographic bbox [min_lon, min_lat, max_lon, max_lat] of every window inside a tile.
+    """
+    offsets = np.asarray(offsets, dtype=np.float64).reshape(-1, 2)
+    res_x = (tile_bbox[2] - tile_bbox[0]) / tile_shape[1]
+    res_y = (tile_bbox[3] - tile_bbox[1]) / tile_shape[0]
+    row_off, col_off = offsets[:, 0], offsets[:, 1]
+    return np.stack([
+        tile_bbox[0] + col_off * res_x,
+        tile_bbox[3] - (row_off + window_px) * res_y,
+        tile_bbox[0] + (col_off + window_px) * res_x,
+        tile_bbox[3] - row_off * res_y,
+    ], axis=1)
+
+
+def reduce_windows(content, tile_bbox, offsets, window_px, reduce_stack):
+    """
+    Decode a tile response, cut out every location's window and reduce all of
+    them to values in one call.
+
+    Runs in a worker process, so only the response bytes go in and only the
+    reduced values come back, together with the seconds spent decoding and
+    reducing.
+
+    tile_bbox: bbox of the tile the response covers
+    offsets: list of (row_off, col_off) of the windows inside the tile
+    window_px: size of each window in pixels
+    reduce_stack: picklable (module level) function (stack, bboxes) -> values,
+        where stack is an (N, window_px, window_px) array, or a dict of them
+        keyed by response identifier, bboxes the (N, 4) window bboxes, and
+        values an (N,) array, or a dict of them keyed by column
+    """
+    start = time.perf_counter()
+    decoded = decode_response(content)
+    decoded_at = time.perf_counter()
+    shape = next(iter(decoded.values())).shape if isinstance(decoded, dict) else decoded.shape
+    bboxes = window_bboxes(tile_bbox, shape, offsets, window_px)
+
+    def stack(arr):
+        return np.stack([arr[row_off:row_off + window_px, col_off:col_off + window_px]
+                         for row_off, col_off in offsets])
+
+    if isinstance(decoded, dict):
+        values = reduce_stack({key: stack(arr) for key, arr in decoded.items()}, bboxes)
+    else:
+        values = reduce_stack(stack(decoded), bboxes)
+
+    if isinstance(values, dict):
+        values = [{key: float(column[i]) for key, column in values.items()} for i in range(len(offsets))]
+    else:
+        values = [float(value) for value in values]
+    return values, {"decode": decoded_at - start, "reduce": time.perf_counter() - decoded_at}
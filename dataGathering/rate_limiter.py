@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from paths import INTERMEDIARY_DIR
+
+LIMITER_PATH = os.path.join(INTERMEDIARY_DIR, "rate_limits.sqlite")
+LEASE_SECONDS = 300  # in-flight requests of crashed processes are freed after this
+POLL_INTERVAL = 0.05  # seconds between checks while the concurrency limit is reached
+DECREASE_FACTOR = 0.5  # multiplicative decrease of the concurrency limit on throttling
+DEFAULT_BACKOFF = 1.0  # seconds to pause after throttling without a Retry-After header
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait from a Retry-After header, given in seconds or as an HTTP date.
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class SharedRateLimiter:
+    """
+    Adaptive rate limiter shared by all threads, coroutines and processes
+    that use the same `name`.
+
+    The state lives in a SQLite database, so parallel pipeline stages draw
+    from the same budget:
+    - a token bucket of requests (`rate` per second up to `capacity`)
+    - an optional bucket of quota units, e.g. Sentinel Hub processing units
+      (`unit_rate` per second up to `unit_capacity`); each request takes its
+      estimated units, corrected with the actual cost once it is known
+    - a concurrency limit adapted with AIMD: it grows by about one for every
+      window of successful requests, and is cut by DECREASE_FACTOR on a 429
+      or 5xx response, which also pauses everyone until Retry-After has passed
+
+    Every request takes a lease with acquire() and gives it back with release().
+    """
+
+    def __init__(self, name, rate, capacity, unit_rate=None, unit_capacity=None, max_concurrency=16,
+                 min_concurrency=1, path=LIMITER_PATH):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.unit_rate = unit_rate
+        self.unit_capacity = unit_capacity
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS limiters (name TEXT PRIMARY KEY, tokens REAL, units REAL, "
+            "updated REAL, concurrency REAL, blocked_until REAL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, expires REAL)")
+        self._db.execute(
+            "INSERT OR IGNORE INTO limiters VALUES (?, ?, ?, ?, ?, 0)",
+            (name, capacity, unit_capacity or 0, time.time(), max_concurrency),
+        )
+
+    def _transaction(self, update):
+        """
+        Run update(now, state) on the shared state in one exclusive transaction
+        and store the state it returns.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                tokens, units, updated, concurrency, blocked_until = self._db.execute(
+                    "SELECT tokens, units, updated, concurrency, blocked_until FROM limiters WHERE name = ?",
+                    (self.name,),
+                ).fetchone()
+                now = time.time()
+                tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+                if self.unit_rate:
+                    units = min(self.unit_capacity, units + (now - updated) * self.unit_rate)
+                state = {"tokens": tokens, "units": units, "concurrency": concurrency, "blocked_until": blocked_until}
+                result = update(now, state)
+                self._db.execute(
+                    "UPDATE limiters SET tokens = ?, units = ?, updated = ?, concurrency = ?, blocked_until = ? "
+                    "WHERE name = ?",
+                    (state["tokens"], state["units"], now, state["concurrency"], state["blocked_until"], self.name),
+                )
+                self._db.execute("COMMIT")
+                return result
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _try_acquire(self, units):
+        """
+        Take a lease if the limits allow it. Returns (lease, 0) or (None, seconds to wait).
+        """
+        if self.unit_rate:
+            units = min(units, self.unit_capacity)
+
+        def update(now, state):
+            self._db.execute("DELETE FROM leases WHERE name = ? AND expires < ?", (self.name, now))
+            in_flight = self._db.execute("SELECT COUNT(*) FROM leases WHERE name = ?", (self.name,)).fetchone()[0]
+
+            if state["blocked_until"] > now:
+                return None, state["blocked_until"] - now
+            if in_flight >= int(state["concurrency"]):
+                return None, POLL_INTERVAL
+            if state["tokens"] < 1:
+                return None, (1 - state["tokens"]) / self.rate
+            if self.unit_rate and state["units"] < units:
+                return None, (units - state["units"]) / self.unit_rate
+
+            state["tokens"] -= 1
+            if self.unit_rate:
+                state["units"] -= units
+            lease = self._db.execute(
+                "INSERT INTO leases (name, expires) VALUES (?, ?)", (self.name, now + LEASE_SECONDS)
+            ).lastrowid
+            return lease, 0.0
+
+        return self._transaction(update)
+
+    def acquire(self, units=0):
+        """
+        Wait until a request costing `units` quota units may be sent.
+        Returns the lease to pass to release().
+        """
+        while True:
+            lease, wait = self._try_acquire(units)
+            if lease is not None:
+                return lease
+            time.sleep(wait)
+
+    async def acquire_async(self, units=0):
+        """
+        Like acquire(), but waits without blocking the event loop.
+        """
+        while True:
+            lease, wait = await asyncio.to_thread(self._try_acquire, units)
+            if lease is not None:
+                return lease
+            await asyncio.sleep(wait)
+
+    def release(self, lease, status=None, retry_after=None, units=0, units_spent=None):
+        """
+        Give back a lease once the response arrived.
+
+        status: HTTP status of the response, None when the request failed
+            without one (e.g. a timeout), which leaves the limits unchanged
+        retry_after: seconds from the Retry-After header, if any
+        units, units_spent: estimated and actual quota units of the request
+        """
+        def update(now, state):
+            self._db.execute("DELETE FROM leases WHERE id = ?", (lease,))
+            if status == 429 or (status is not None and status >= 500):
+                state["concurrency"] = max(self.min_concurrency, state["concurrency"] * DECREASE_FACTOR)
+                pause = retry_after if retry_after is not None else DEFAULT_BACKOFF
+                state["blocked_until"] = max(state["blocked_until"], now + pause)
+            elif status is not None and status < 400:
+                state["concurrency"] = min(self.max_concurrency, state["concurrency"] + 1 / state["concurrency"])
+            if self.unit_rate and units_spent is not None:
+                state["units"] -= units_spent - units
+
+        self._transaction(update)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from paths import DATA_DIR
+
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+MAX_CACHE_BYTES = 2 * 1024 ** 3  # 2 GB
+ACCESS_BATCH = 1000  # access times buffered before they are written
+
+
+def make_key(endpoint, request):
+    """
+    Content hash of a request: the endpoint plus the JSON payload or query
+    parameters (evalscript, bbox, time range, output spec, ...).
+    """
+    canonical = json.dumps({"endpoint": endpoint, "request": request}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of API responses keyed by the hash of the request.
+
+    Response bodies are stored as files named after their key, and a SQLite
+    index tracks their size and last access time. When the cache grows past
+    `max_bytes` the least recently used entries are evicted.
+
+    Access times of cache hits are buffered in memory and written in one
+    transaction with the next put, every ACCESS_BATCH hits, or on flush(),
+    so warm runs do not commit to SQLite for every hit.
+    """
+
+    def __init__(self, path=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._accessed = {}
+
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_access REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        self._db.commit()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key):
+        """
+        Return the cached response body for key, or None on a miss.
+        """
+        with self._lock:
+            try:
+                with open(self._file(key), "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH:
+                self._write_accesses()
+                self._db.commit()
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        """
+        Store a response body and evict old entries if the cache is full.
+        """
+        with self._lock:
+            file = self._file(key)
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            tmp_file = f"{file}.{os.getpid()}.tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(content)
+            os.replace(tmp_file, file)
+            self._accessed.pop(key, None)
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                (key, len(content), time.time()),
+            )
+            # Eviction sees the latest access times
+            self._write_accesses()
+            self._evict()
+            self._db.commit()
+
+    def _write_accesses(self):
+        if self._accessed:
+            self._db.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                 [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed = {}
+
+    def flush(self):
+        """
+        Write the buffered access times.
+        """
+        with self._lock:
+            self._write_accesses()
+            self._db.commit()
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            evicted.append(key)
+            total -= size
+
+        for key in evicted:
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in evicted])
+
+    def summary(self):
+        self.flush()
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return f"Cache: {self.hits} hits, {self.misses} misses, {count} entries ({size / 1024 ** 2:.1f} MB)"
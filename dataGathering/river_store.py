@@ -0,0 +1,49 @@
+import os
+
+import geopandas as gpd
+from paths import DATA_DIR, INTERMEDIARY_DIR
+
+RIVERS_SHP = os.path.join(DATA_DIR, "HydroRIVERS_v10_eu_shp", "HydroRIVERS_v10_eu.shp")  # HydroSHEDS Europe shapefile
+RIVERS_PARQUET = os.path.join(INTERMEDIARY_DIR, "HydroRIVERS_v10_eu_3857.parquet")
+RIVERS_CRS = 3857
+ROW_GROUP_SIZE = 20_000  # river segments per row group, the unit of bbox pruning
+
+
+def convert_rivers(src=RIVERS_SHP, dst=RIVERS_PARQUET, row_group_size=ROW_GROUP_SIZE):
+    """
+    One-time conversion of the HydroRIVERS shapefile into a GeoParquet copy in
+    EPSG:3857, sorted along a Hilbert curve.
+
+    The file stores a bbox covering column, so the min/max statistics of every
+    row group form a persisted spatial index: readers with a bbox only load
+    the row groups that intersect it, and only the columns they ask for.
+    """
+    print(f"Converting {src} to GeoParquet...")
+    rivers = gpd.read_file(src).to_crs(epsg=RIVERS_CRS)
+    rivers = rivers.iloc[rivers.geometry.hilbert_distance().argsort()].reset_index(drop=True)
+
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    tmp_path = dst + ".tmp"
+    rivers.to_parquet(tmp_path, index=False, write_covering_bbox=True, row_group_size=row_group_size)
+    os.replace(tmp_path, dst)
+    print(f"Saved {len(rivers)} river segments to {dst}")
+
+
+def load_rivers(columns=(), bbox=None, filters=None, path=RIVERS_PARQUET, src=RIVERS_SHP):
+    """
+    Load river segments in EPSG:3857 from the GeoParquet copy, converting the
+    shapefile first if the copy is missing or older than it.
+
+    columns: attribute columns to read besides the geometry, e.g. ["DIS_AV_CMS"]
+    bbox: optional (minx, miny, maxx, maxy) in EPSG:3857; only row groups
+        intersecting it are read, and only segments intersecting it are kept
+    filters: optional pyarrow filters on the attributes, pushed down to the
+        row groups as well, e.g. [("DIS_AV_CMS", ">=", 1.2)]
+    """
+    if not os.path.exists(path) or (os.path.exists(src) and os.path.getmtime(src) > os.path.getmtime(path)):
+        convert_rivers(src, path)
+    return gpd.read_parquet(path, columns=[*columns, "geometry"], bbox=bbox, filters=filters)
+
+
+if __name__ == "__main__":
+    convert_rivers()
@@ -0,0 +1,313 @@
+import glob
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import groupby
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from tqdm import tqdm
+
+from checkpoint_store import CheckpointStore, location_key
+from metrics import Metrics
+from tile_planner import TILE_DEG, plan_tiles
+
+# Directory of local Sentinel-2 L2A scenes (see find_scenes) to compute the
+# spectral indices from instead of calling Sentinel Hub; None to use the API
+S2_SCENES_DIR = None
+
+# Bands of the normalized difference (a - b) / (a + b) of every index and the
+# scene classes it skips, as in the extractors' evalscripts: cloud shadows
+# (3), clouds (8, 9), cirrus (10) and snow (11), and water (6) for NDVI
+INDEX_BANDS = {
+    "ndvi": ("B08", "B04"),
+    "ndwi": ("B03", "B08"),
+    "ndbi": ("B11", "B08"),
+    "mndwi": ("B03", "B11"),
+}
+EXCLUDED_SCL = {
+    "ndvi": (3, 6, 8, 9, 10, 11),
+    "ndwi": (3, 8, 9, 10, 11),
+    "ndbi": (3, 8, 9, 10, 11),
+    "mndwi": (3, 8, 9, 10, 11),
+}
+# Processing baseline 04.00 (from 25 January 2022) added an offset of 1000 to
+# the L2A digital numbers; Sentinel Hub removes it, so it is removed here too
+BOA_ADD_OFFSET = -1000
+OFFSET_BASELINE = 400
+OFFSET_START = date(2022, 1, 25)
+WGS84 = CRS.from_epsg(4326)
+
+
+class Scene:
+    """
+    One local Sentinel-2 L2A acquisition.
+
+    bands: dict of band name -> file path
+    bounds: (min_lon, min_lat, max_lon, max_lat) of the scene
+    offset: value added to the digital numbers to harmonize them
+    """
+
+    def __init__(self, path, acquired, bands, cloud_cover, offset, bounds):
+        self.path = path
+        self.date = acquired
+        self.bands = bands
+        self.cloud_cover = cloud_cover
+        self.offset = offset
+        self.bounds = bounds
+
+
+def _band_file(directory, band):
+    # SAFE products name their band files like T32TPS_20240415T101559_B03_10m.jp2,
+    # COG downloads usually like B03.tif
+    for pattern in (f"**/*_{band}_*.jp2", f"**/{band}.tif", f"**/*_{band}.tif", f"**/*{band}*.tif"):
+        matches = sorted(glob.glob(os.path.join(directory, pattern), recursive=True))
+        if matches:
+            # The highest resolution comes first in SAFE products (R10m before R20m)
+            return matches[0]
+    return None
+
+
+def _safe_metadata(directory):
+    """
+    Cloud cover and BOA offset from the MTD_MSIL2A.xml of a SAFE product, if present.
+    """
+    path = os.path.join(directory, "MTD_MSIL2A.xml")
+    if not os.path.exists(path):
+        return None, None
+    root = ET.parse(path).getroot()
+    cloud = root.find(".//Cloud_Coverage_Assessment")
+    offset = root.find(".//BOA_ADD_OFFSET")
+    return (float(cloud.text) if cloud is not None else None,
+            int(offset.text) if offset is not None else None)
+
+
+def _stac_cloud_cover(directory):
+    # COG downloads often come with their STAC item
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        with open(path) as f:
+            properties = json.load(f).get("properties", {})
+        if "eo:cloud_cover" in properties:
+            return float(properties["eo:cloud_cover"])
+    return None
+
+
+def _check_scenes_dir(scenes_dir):
+    if scenes_dir is None:
+        raise ValueError("No Sentinel-2 scenes directory: set S2_SCENES_DIR in s2_local.py or pass a scenes "
+                         "directory, e.g. `python get_ndvi_values.py local <dir>` or `--s2-scenes <dir>`")
+    if not os.path.isdir(scenes_dir):
+        raise ValueError(f"Sentinel-2 scenes directory {scenes_dir} does not exist")
+
+
+def find_scenes(root, bands, start_date=None, end_date=None, max_cloud_cover=None):
+    """
+    Find the Sentinel-2 L2A scenes in the subdirectories of `root`.
+
+    Every scene is a SAFE product (*.SAFE) or a directory of COG band files,
+    e.g. B03.tif, B04.tif, B08.tif, B11.tif and SCL.tif. The acquisition date
+    is read from the directory name (the first YYYYMMDD in it), the cloud
+    cover from MTD_MSIL2A.xml or a STAC item JSON when present.
+
+    bands: bands every scene must have
+    start_date, end_date: optional "YYYY-MM-DD" range of acquisition dates
+    max_cloud_cover: skip scenes with more cloud cover (percent), as the
+        maxCloudCoverPercentage filter of the Process API; scenes without
+        cloud cover metadata are kept
+    """
+    _check_scenes_dir(root)
+    scenes = []
+    for directory in sorted(glob.glob(os.path.join(root, "*"))):
+        name = os.path.basename(directory.rstrip("/"))
+        match = re.search(r"(\d{4})(\d{2})(\d{2})", name)
+        if not os.path.isdir(directory) or match is None:
+            continue
+        acquired = date(*map(int, match.groups()))
+        if (start_date and acquired < date.fromisoformat(start_date)) or \
+                (end_date and acquired > date.fromisoformat(end_date)):
+            continue
+
+        files = {band: _band_file(directory, band) for band in bands}
+        if None in files.values():
+            print(f"Skipping {name}: missing bands {[band for band, path in files.items() if path is None]}")
+            continue
+
+        cloud_cover, offset = _safe_metadata(directory)
+        if cloud_cover is None:
+            cloud_cover = _stac_cloud_cover(directory)
+        if max_cloud_cover is not None and cloud_cover is not None and cloud_cover > max_cloud_cover:
+            continue
+        if offset is None:
+            baseline = re.search(r"_N(\d{4})_", name)
+            harmonize = int(baseline.group(1)) >= OFFSET_BASELINE if baseline else acquired >= OFFSET_START
+            offset = BOA_ADD_OFFSET if harmonize else 0
+
+        with rasterio.open(files["SCL"]) as src:
+            bounds = transform_bounds(src.crs, WGS84, *src.bounds)
+        scenes.append(Scene(directory, acquired, files, cloud_cover, offset, bounds))
+    return scenes
+
+
+def _read_tile(path, bbox, width, height):
+    """
+    Read a band on the tile's EPSG:4326 pixel grid. Only the source blocks
+    under the tile are read; pixels outside the scene are 0 (no data).
+    """
+    with rasterio.open(path) as src:
+        with WarpedVRT(src, crs=WGS84, transform=from_bounds(*bbox, width, height), width=width, height=height,
+                       resampling=Resampling.nearest, nodata=0) as vrt:
+            return vrt.read(1)
+
+
+def _overlaps(scene, bbox):
+    return not (scene.bounds[0] > bbox[2] or scene.bounds[2] < bbox[0]
+                or scene.bounds[1] > bbox[3] or scene.bounds[3] < bbox[1])
+
+
+def _mosaic(scenes, bbox, width, height, bands):
+    """
+    Read the granules of one acquisition date onto the tile grid as one
+    observation: every pixel comes from the first granule with data there.
+    Returns the scene classes (0 where no granule has data) and the
+    harmonized reflectances per band (NaN where missing).
+    """
+    scl = np.zeros((height, width), dtype=np.uint8)
+    values = {band: np.full((height, width), np.nan) for band in bands}
+    for scene in scenes:
+        granule_scl = _read_tile(scene.bands["SCL"], bbox, width, height)
+        fill = (scl == 0) & (granule_scl != 0)
+        if not fill.any():
+            continue
+        scl[fill] = granule_scl[fill]
+        for band in bands:
+            raw = _read_tile(scene.bands[band], bbox, width, height).astype(np.float64)
+            values[band][fill] = np.where(raw == 0, np.nan, np.maximum(raw + scene.offset, 0))[fill]
+    return scl, values
+
+
+def tile_indices(bbox, width, height, offsets, window_px, scenes, indices):
+    """
+    Temporal mean indices of all windows of one tile, from local scenes.
+
+    As in the evalscripts, every pixel's index is averaged over the
+    acquisitions where the scene class is not excluded and the value is
+    finite, then the window's value is the mean over its pixels. Overlapping
+    granules of the same date are mosaicked first, so a pixel counts once per
+    acquisition as with the ORBIT mosaicking of the Process API. All windows
+    of the tile are computed at once from one read per band and granule.
+    Returns {index: (N,) array}, NaN where no valid pixel was found.
+    """
+    sums = {index: np.zeros((height, width)) for index in indices}
+    counts = {index: np.zeros((height, width), dtype=np.int32) for index in indices}
+    bands = sorted({band for index in indices for band in INDEX_BANDS[index]})
+
+    overlapping = sorted((scene for scene in scenes if _overlaps(scene, bbox)), key=lambda scene: scene.date)
+    for _, granules in groupby(overlapping, key=lambda scene: scene.date):
+        scl, values = _mosaic(granules, bbox, width, height, bands)
+        if not scl.any():
+            continue
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for index in indices:
+                a, b = (values[band] for band in INDEX_BANDS[index])
+                index_values = (a - b) / (a + b)
+                valid = np.isfinite(index_values) & ~np.isin(scl, EXCLUDED_SCL[index])
+                sums[index][valid] += index_values[valid]
+                counts[index] += valid
+
+    rows = np.asarray([row_off for row_off, _ in offsets])[:, None] + np.arange(window_px)
+    cols = np.asarray([col_off for _, col_off in offsets])[:, None] + np.arange(window_px)
+    result = {}
+    for index in indices:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(counts[index] > 0, sums[index] / counts[index], np.nan)
+        stack = mean[rows[:, :, None], cols[:, None, :]]
+        valid = np.isfinite(stack).sum(axis=(1, 2))
+        result[index] = np.where(valid > 0, np.nansum(stack, axis=(1, 2)) / np.maximum(valid, 1), np.nan)
+    return result
+
+
+def _tile_task(args):
+    tile_bbox, width, height, offsets, window_px, scenes, indices = args
+    return tile_indices(tile_bbox, width, height, offsets, window_px, scenes, indices)
+
+
+def request_parameters(payload):
+    """
+    Window size, time range and cloud cover filter of an extractor's Process
+    API request, so the local backend computes the same windows and period.
+    """
+    bbox = payload["input"]["bounds"]["bbox"]
+    data_filter = payload["input"]["data"][0]["dataFilter"]
+    return {
+        "buffer_deg": (bbox[2] - bbox[0]) / 2,
+        "window_px": payload["output"]["width"],
+        "start_date": data_filter["timeRange"]["from"][:10],
+        "end_date": data_filter["timeRange"]["to"][:10],
+        "max_cloud_cover": data_filter.get("maxCloudCoverPercentage"),
+    }
+
+
+def extract_local_indices(name, locations, build_request, indices, scenes_dir=S2_SCENES_DIR, workers=None,
+                          tile_deg=TILE_DEG, desc="Computing indices"):
+    """
+    Compute spectral indices per location from local Sentinel-2 L2A scenes
+    instead of the Process API.
+
+    name: extractor name, e.g. "ndvi" or "spectral_indices"
+    build_request: the extractor's Process API request builder, whose window
+        size, time range and cloud cover filter are reproduced
+    indices: indices to compute, keys of INDEX_BANDS
+
+    Nearby locations are grouped into tiles as for the Process API, and the
+    tiles are computed in a pool of `workers` processes, so throughput scales
+    with the local cores. Results are checkpointed; adding scenes changes the
+    configuration, so all locations are computed again.
+    Returns a list of {'name', 'latitude', 'longitude', *indices} dicts in the
+    order of `locations`.
+    """
+    _check_scenes_dir(scenes_dir)
+    params = request_parameters(build_request(0, 0))
+    bands = sorted({band for index in indices for band in INDEX_BANDS[index]} | {"SCL"})
+    scenes = find_scenes(scenes_dir, bands, params["start_date"], params["end_date"], params["max_cloud_cover"])
+    print(f"Found {len(scenes)} scenes in {scenes_dir}")
+
+    metrics = Metrics(f"{name}_local")
+    rows = locations[["name", "latitude", "longitude"]].to_dict("records")
+    config = {"local": params, "indices": list(indices), "scenes": [os.path.basename(s.path) for s in scenes]}
+    with CheckpointStore(f"{name}_local", config=config) as store:
+        tiles = [
+            tile for tile in plan_tiles(rows, params["buffer_deg"], params["window_px"], tile_deg=tile_deg)
+            if any(location_key(row["latitude"], row["longitude"]) not in store for row, _, _ in tile.members)
+        ]
+        tasks = [
+            (tile.bbox, tile.width, tile.height, [(row_off, col_off) for _, row_off, col_off in tile.members],
+             tile.window_px, scenes, list(indices))
+            for tile in tiles
+        ]
+        with metrics.timer("compute"), ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, \
+                tqdm(total=sum(len(tile.members) for tile in tiles), desc=desc) as pbar:
+            for tile, values in zip(tiles, pool.map(_tile_task, tasks)):
+                with metrics.timer("checkpoint"):
+                    for i, (row, _, _) in enumerate(tile.members):
+                        store.add({**row, **{index: None if np.isnan(values[index][i]) else float(values[index][i])
+                                             for index in indices}})
+                pbar.update(len(tile.members))
+        metrics.inc("tiles", len(tiles))
+        metrics.inc("scenes", len(scenes))
+        metrics.report()
+        metrics.export()
+
+        return [
+            {**row, **{index: (store.get(location_key(row["latitude"], row["longitude"])) or {}).get(index)
+                       for index in indices}}
+            for row in rows
+        ]
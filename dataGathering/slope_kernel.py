@@ -0,0 +1,48 @@
+import warnings
+
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # mean Earth radius in metres
+METERS_PER_DEGREE = np.pi / 180 * EARTH_RADIUS
+PERCENTILE = 90
+
+
+def slope_statistics(dem_stack, bboxes, percentile=PERCENTILE):
+    """
+    Slope statistics in degrees for a stack of DEM windows, all at once.
+
+    dem_stack: (N, H, W) array of elevations in metres, NaN for nodata
+    bboxes: (N, 4) array of [min_lon, min_lat, max_lon, max_lat] per window
+
+    The ground spacing of every pixel is computed from its window's bbox: the
+    north-south spacing from the degrees per row, and the east-west spacing
+    from the degrees per column scaled by the cosine of the row's latitude.
+
+    Returns a dict of (N,) arrays: 'slope_degrees' (mean), 'slope_max' and
+    'slope_p<percentile>'.
+    """
+    dem_stack = np.asarray(dem_stack, dtype=np.float64)
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    n, height, width = dem_stack.shape
+    key = f"slope_p{percentile}"
+    if n == 0:
+        return {"slope_degrees": np.empty(0), "slope_max": np.empty(0), key: np.empty(0)}
+
+    deg_x = (bboxes[:, 2] - bboxes[:, 0]) / width
+    deg_y = (bboxes[:, 3] - bboxes[:, 1]) / height
+    row_lats = bboxes[:, 3, None] - (np.arange(height) + 0.5) * deg_y[:, None]
+
+    spacing_y = (deg_y * METERS_PER_DEGREE)[:, None, None]
+    spacing_x = (deg_x[:, None] * METERS_PER_DEGREE * np.cos(np.radians(row_lats)))[:, :, None]
+
+    dz_y, dz_x = np.gradient(dem_stack, axis=(1, 2))
+    slope = np.degrees(np.arctan(np.hypot(dz_x / spacing_x, dz_y / spacing_y)))
+
+    # Windows without any valid pixel give NaN, which is expected here
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return {
+            "slope_degrees": np.nanmean(slope, axis=(1, 2)),
+            "slope_max": np.nanmax(slope, axis=(1, 2)),
+            key: np.nanpercentile(slope.reshape(n, -1), percentile, axis=1),
+        }
@@ -0,0 +1,270 @@
+import copy
+import json
+import math
+from datetime import datetime
+
+import pandas as pd
+
+from checkpoint_store import CheckpointStore
+from extraction_engine import ExtractionEngine, MAX_CONCURRENCY
+from metrics import Metrics
+
+STATISTICS_URL = "https://sh.dataspace.copernicus.eu/api/v1/statistics"
+PERCENTILES = (10, 50, 90)
+SERIES_INTERVAL = "P1M"  # ISO 8601 duration of the series intervals, "P1D" for every acquisition
+SERIES_PERCENTILES = ()  # kept small, the series has a row per location and interval
+
+# Appended to an extractor's evalscript: the Statistical API needs a dataMask
+# output, which marks the pixels the statistics are computed over. Pixels
+# whose value is not finite (no valid acquisition) are masked out, as the
+# nanmean of the Process API backend skips them.
+DATA_MASK_WRAPPER = """
+var processSetup = setup;
+var processEvaluatePixel = evaluatePixel;
+
+setup = function () {
+  var config = processSetup();
+  var outputs = [].concat(config.output).map(function (output) {
+    return output.id ? output : Object.assign({ id: "default" }, output);
+  });
+  if (!outputs.some(function (output) { return output.id === "dataMask"; })) {
+    outputs.push({ id: "dataMask", bands: 1 });
+  }
+  config.output = outputs;
+  return config;
+};
+
+evaluatePixel = function (samples, scenes, inputMetadata, customData, outputMetadata) {
+  var result = processEvaluatePixel(samples, scenes, inputMetadata, customData, outputMetadata);
+  if (Array.isArray(result)) {
+    result = { default: result };
+  }
+  if (!("dataMask" in result)) {
+    var valid = Object.keys(result).every(function (id) {
+      return result[id].every(function (value) { return isFinite(value); });
+    });
+    result.dataMask = [valid ? 1 : 0];
+  }
+  return result;
+};
+"""
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def statistical_request(payload, percentiles=PERCENTILES, interval=None):
+    """
+    Turn a single-location Process API payload into a Statistical API payload
+    with the same evalscript, area, data filter and resolution.
+
+    By default the whole time range is aggregated as one interval, so the
+    evalscript still sees every acquisition of a pixel and the statistics
+    describe its temporal means, as the Process API backend does. With an
+    `interval` such as "P1M" the range is split into intervals and the
+    response holds the statistics of each, from the same single request.
+    """
+    payload = copy.deepcopy(payload)
+    time_range = payload["input"]["data"][0]["dataFilter"]["timeRange"]
+    if interval is None:
+        days = math.ceil((_parse_time(time_range["to"]) - _parse_time(time_range["from"])).total_seconds() / 86400)
+        aggregation_interval = {"of": f"P{days}D", "lastIntervalBehavior": "EXTEND"}
+    else:
+        # The last interval is cut at the end of the range instead of reaching past it
+        aggregation_interval = {"of": interval, "lastIntervalBehavior": "SHORTEN"}
+    request = {
+        "input": payload["input"],
+        "aggregation": {
+            "timeRange": time_range,
+            "aggregationInterval": aggregation_interval,
+            "evalscript": payload["evalscript"] + DATA_MASK_WRAPPER,
+            "width": payload["output"]["width"],
+            "height": payload["output"]["height"],
+        },
+    }
+    # Mean, standard deviation and counts are always returned, percentiles on request
+    if percentiles:
+        request["calculations"] = {
+            "default": {"statistics": {"default": {"percentiles": {"k": list(percentiles)}}}},
+        }
+    return request
+
+
+def statistics_columns(output, percentiles=PERCENTILES):
+    """
+    Feature columns produced for one output: the mean under the output's own
+    name, as the Process API backend stores it, plus spread, percentiles and
+    the number of valid pixels.
+    """
+    return [output, f"{output}_std", *(f"{output}_p{k}" for k in percentiles), f"{output}_valid_pixels"]
+
+
+def _number(value):
+    # Statistics of fully masked areas come back as "NaN" strings or are missing
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def _interval_statistics(interval, output, percentiles):
+    # Statistics of one output in one interval, keyed by the column suffixes
+    bands = interval["outputs"].get(output, {}).get("bands", {})
+    stats = next(iter(bands.values()), {}).get("stats", {})
+    reported = stats.get("percentiles", {})
+    values = {"": _number(stats.get("mean")), "_std": _number(stats.get("stDev"))}
+    for k in percentiles:
+        values[f"_p{k}"] = _number(reported.get(f"{float(k)}", reported.get(str(k))))
+    values["_valid_pixels"] = stats["sampleCount"] - stats.get("noDataCount", 0) if "sampleCount" in stats else None
+    return values
+
+
+def _intervals(body):
+    return [interval for interval in json.loads(body).get("data", []) if "error" not in interval]
+
+
+def parse_statistics(body, output, percentiles=PERCENTILES):
+    """
+    Read the statistics of one evalscript output from a Statistical API
+    response body into {column: value}, with None for missing values.
+    """
+    intervals = _intervals(body)
+    if not intervals:
+        return dict.fromkeys(statistics_columns(output, percentiles))
+    values = _interval_statistics(intervals[0], output, percentiles)
+    return {output + suffix: value for suffix, value in values.items()}
+
+
+def series_columns(percentiles=SERIES_PERCENTILES):
+    """
+    Columns of the rows of a series, besides the interval 'date'.
+    """
+    return ["mean", "std", *(f"p{k}" for k in percentiles), "valid_pixels"]
+
+
+def parse_series(body, output, percentiles=SERIES_PERCENTILES):
+    """
+    Read the statistics of one evalscript output for every interval of a
+    Statistical API response into a list of {'date', *series_columns} rows,
+    'date' being the start of the interval. Intervals without valid pixels,
+    e.g. days without an acquisition, are left out.
+    """
+    rows = []
+    for interval in _intervals(body):
+        values = _interval_statistics(interval, output, percentiles)
+        if values[""] is None or not values["_valid_pixels"]:
+            continue
+        rows.append({"date": interval["interval"]["from"][:10],
+                     **{column: value for column, value in zip(series_columns(percentiles), values.values())}})
+    return rows
+
+
+class StatisticsEngine(ExtractionEngine):
+    """
+    Extraction engine for the Sentinel Hub Statistical API.
+
+    Instead of a raster per location, which the client reduces to one value,
+    the API returns mean, standard deviation, percentiles and valid pixel
+    counts per location as a small JSON document. Requests reuse the
+    extractors' Process API request builders (see statistical_request), and
+    share the retries, rate limiting, response cache, token handling and
+    metrics of ExtractionEngine.
+
+    With an `interval` (e.g. "P1M") every location gets a time series of the
+    statistics per interval instead, still from one request, in a 'series'
+    column holding parse_series rows.
+
+    The Statistical API aggregates one area per request, so locations are not
+    batched into tiles. Only per-pixel evalscripts translate: slope needs the
+    neighbouring DEM pixels, which an evalscript cannot see, so it stays on
+    the Process API.
+    """
+
+    def __init__(self, api_url=STATISTICS_URL, percentiles=PERCENTILES, interval=None, **kwargs):
+        super().__init__(api_url=api_url, **kwargs)
+        self.percentiles = percentiles
+        self.interval = interval
+
+    async def _process_tile(self, session, semaphore, pool, tile, build_request, output, columns, accept):
+        (row, _, _), = tile.members
+        payload = statistical_request(build_request(row["latitude"], row["longitude"]), self.percentiles,
+                                      self.interval)
+        body = await self._fetch_cached(session, semaphore, payload, accept)
+
+        values = dict.fromkeys(columns)
+        if body is not None:
+            try:
+                with self.metrics.timer("reduce"):
+                    if self.interval is None:
+                        values = parse_statistics(body, output, self.percentiles)
+                    else:
+                        values = {"series": parse_series(body, output, self.percentiles)}
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Failed to parse statistics for {row['name']}: {e}")
+                self.metrics.inc("errors", kind="decode")
+        return [{**row, **values}]
+
+    def run(self, locations, build_request, output, on_result=None, desc="Fetching", checkpoint=None):
+        """
+        Extract the statistics of one evalscript output per location.
+
+        locations: DataFrame with 'name', 'latitude' and 'longitude' columns
+        build_request: function (lat, lon) -> Process API payload
+        output: evalscript output to read, e.g. "ndvi"
+        on_result, checkpoint: as for ExtractionEngine.run
+
+        Returns a list of dicts with 'name', 'latitude', 'longitude' and the
+        statistics_columns of `output`, or the 'series' of the location when
+        the engine has an interval, in the order of `locations`.
+        """
+        columns = statistics_columns(output, self.percentiles) if self.interval is None else ["series"]
+        return super().run(locations, build_request, output, columns, accept="application/json",
+                           on_result=on_result, desc=desc, tile_deg=None, checkpoint=checkpoint)
+
+
+def extract_statistics(name, locations, build_request, output=None, desc="Fetching", **engine_kwargs):
+    """
+    Run an extractor on the Statistical API backend, checkpointed separately
+    from its Process API results.
+
+    name: extractor name, e.g. "ndvi"
+    output: evalscript output to read, defaults to `name`
+    """
+    output = output or name
+    config = {"request": statistical_request(build_request(0, 0)), "output": output}
+    with CheckpointStore(f"{name}_statistics", config=config) as store:
+        engine = StatisticsEngine(max_concurrency=engine_kwargs.pop("max_concurrency", MAX_CONCURRENCY),
+                                  metrics=engine_kwargs.pop("metrics", Metrics(f"{name}_statistics")),
+                                  **engine_kwargs)
+        return engine.run(locations, build_request, output, checkpoint=store, desc=desc)
+
+
+def extract_series(name, locations, build_request, interval=SERIES_INTERVAL, output=None,
+                   percentiles=SERIES_PERCENTILES, desc="Fetching", **engine_kwargs):
+    """
+    Extract a time series of an index per location, one Statistical API
+    request per location however many intervals it covers.
+
+    name: extractor name, e.g. "ndvi"
+    interval: ISO 8601 duration of the intervals, e.g. "P1M" for monthly or
+        "P1D" for every acquisition
+    output: evalscript output to read, defaults to `name`
+
+    Returns a long DataFrame with one row per location and interval:
+    'name', 'latitude', 'longitude', 'date' and the series_columns.
+    """
+    output = output or name
+    config = {"request": statistical_request(build_request(0, 0), percentiles, interval), "output": output}
+    with CheckpointStore(f"{name}_series", config=config) as store:
+        engine = StatisticsEngine(max_concurrency=engine_kwargs.pop("max_concurrency", MAX_CONCURRENCY),
+                                  metrics=engine_kwargs.pop("metrics", Metrics(f"{name}_series")),
+                                  percentiles=percentiles, interval=interval, **engine_kwargs)
+        results = engine.run(locations, build_request, output, checkpoint=store, desc=desc)
+
+    rows = [
+        {"name": result["name"], "latitude": result["latitude"], "longitude": result["longitude"], **row}
+        for result in results for row in result.get("series") or []
+    ]
+    return pd.DataFrame(rows, columns=["name", "latitude", "longitude", "date", *series_columns(percentiles)])
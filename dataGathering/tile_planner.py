@@ -0,0 +1,138 @@
+import math
+
+import numpy as np
+
+TILE_DEG = 0.02  # size of the grid cells used to group nearby locations
+MAX_TILE_PX = 2500  # Process API limit for output width and height
+MAX_OVERHEAD = 4.0  # max ratio of tile pixels to the pixels of its location windows
+
+
+class Tile:
+    """
+    One Process API request covering one or more locations.
+
+    bbox: [min_lon, min_lat, max_lon, max_lat] of the request
+    width, height: output size in pixels
+    members: list of (row, row_off, col_off) with the location row and the
+        offset of its window inside the returned raster
+    window_px: size of each location's window in pixels
+    """
+
+    def __init__(self, bbox, width, height, members, window_px):
+        self.bbox = bbox
+        self.width = width
+        self.height = height
+        self.members = members
+        self.window_px = window_px
+
+
+def hilbert_index(lon, lat, order=16):
+    """
+    Position of each (lon, lat) pair along a Hilbert curve covering the globe.
+    Points that are close in space get close indices.
+    """
+    n = 1 << order
+    x = ((np.asarray(lon, dtype=np.float64) + 180) / 360 * (n - 1)).astype(np.int64)
+    y = ((np.asarray(lat, dtype=np.float64) + 90) / 180 * (n - 1)).astype(np.int64)
+    d = np.zeros_like(x)
+
+    s = n >> 1
+    while s > 0:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        d += s * s * ((3 * rx) ^ ry)
+
+        # Rotate the quadrant so the curve stays continuous
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+
+    return d
+
+
+def _single_tile(row, buffer_deg, window_px):
+    lat, lon = row["latitude"], row["longitude"]
+    bbox = [lon - buffer_deg, lat - buffer_deg, lon + buffer_deg, lat + buffer_deg]
+    return Tile(bbox, window_px, window_px, [(row, 0, 0)], window_px)
+
+
+def _group_tile(rows, buffer_deg, window_px):
+    res = 2 * buffer_deg / window_px
+
+    # Snap the tile to a global pixel grid so windows line up with whole pixels
+    min_lon = math.floor(min(r["longitude"] - buffer_deg for r in rows) / res) * res
+    max_lat = math.ceil(max(r["latitude"] + buffer_deg for r in rows) / res) * res
+    max_lon = max(r["longitude"] + buffer_deg for r in rows)
+    min_lat = min(r["latitude"] - buffer_deg for r in rows)
+    width = max(window_px, math.ceil((max_lon - min_lon) / res))
+    height = max(window_px, math.ceil((max_lat - min_lat) / res))
+
+    members = []
+    for r in rows:
+        col_off = round((r["longitude"] - buffer_deg - min_lon) / res)
+        row_off = round((max_lat - (r["latitude"] + buffer_deg)) / res)
+        members.append((r, min(max(row_off, 0), height - window_px), min(max(col_off, 0), width - window_px)))
+
+    bbox = [min_lon, max_lat - height * res, min_lon + width * res, max_lat]
+    return Tile(bbox, width, height, members, window_px)
+
+
+def plan_tiles(rows, buffer_deg, window_px=50, tile_deg=TILE_DEG, max_overhead=MAX_OVERHEAD):
+    """
+    Group locations into tile requests and order them along a Hilbert curve.
+
+    rows: list of dicts with 'latitude' and 'longitude'
+    buffer_deg: half the size of a location's window in degrees
+    window_px: size of a location's window in pixels
+    tile_deg: size of the grid cells used for grouping, None for one tile per location
+    max_overhead: cells whose tile would need more than this many times the
+        pixels of their windows are split into smaller cells
+
+    Returns a list of Tile objects in dispatch order.
+    """
+    if not rows:
+        return []
+
+    lons = np.array([r["longitude"] for r in rows], dtype=np.float64)
+    lats = np.array([r["latitude"] for r in rows], dtype=np.float64)
+    order = np.argsort(hilbert_index(lons, lats), kind="stable")
+
+    if tile_deg is None:
+        return [_single_tile(rows[i], buffer_deg, window_px) for i in order]
+
+    # Keep tiles within the Process API size limit
+    res = 2 * buffer_deg / window_px
+    tile_deg = min(tile_deg, (MAX_TILE_PX - 1) * res - 2 * buffer_deg)
+
+    return _plan_cell([rows[i] for i in order], buffer_deg, window_px, tile_deg, max_overhead)
+
+
+def _plan_cell(rows, buffer_deg, window_px, cell_deg, max_overhead):
+    """
+    Split rows into grid cells of size cell_deg and make one tile per cell.
+    Cells whose tile would be too sparse are split into quarters again.
+    """
+    cells = {}
+    for r in rows:
+        key = (math.floor(r["longitude"] / cell_deg), math.floor(r["latitude"] / cell_deg))
+        cells.setdefault(key, []).append(r)
+
+    # Cells are visited in Hilbert order of their first location
+    tiles = []
+    for cell_rows in cells.values():
+        if len(cell_rows) == 1:
+            tiles.append(_single_tile(cell_rows[0], buffer_deg, window_px))
+            continue
+
+        tile = _group_tile(cell_rows, buffer_deg, window_px)
+        if tile.width * tile.height <= max_overhead * len(cell_rows) * window_px ** 2:
+            tiles.append(tile)
+        elif cell_deg / 2 > 2 * buffer_deg:
+            tiles.extend(_plan_cell(cell_rows, buffer_deg, window_px, cell_deg / 2, max_overhead))
+        else:
+            tiles.extend(_single_tile(r, buffer_deg, window_px) for r in cell_rows)
+
+    return tiles
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import threading
+import time
+
+import requests
+
+from paths import CLIENT_INFO_PATH
+
+AUTH_URL = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
+# Refresh this many seconds before the token expires, longer than the request
+# timeout so requests sent with the old token still arrive before it expires
+REFRESH_MARGIN = 150
+DEFAULT_EXPIRES_IN = 600  # used when the identity server does not send expires_in
+
+
+def load_auth_data(path=CLIENT_INFO_PATH):
+    """
+    Load the OAuth client credentials for the Copernicus Data Space.
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def request_token(auth_data, auth_url=AUTH_URL):
+    """
+    Request a new token from the Copernicus Data Space identity server.
+    Returns the token response with 'access_token' and 'expires_in'.
+    """
+    print("Authenticating with Copernicus Data Space...")
+    response = requests.post(auth_url, data=auth_data, timeout=60)
+    if response.status_code != 200:
+        raise Exception("Failed to retrieve tokens:", response.status_code, response.text)
+    return response.json()
+
+
+def get_access_token(auth_data):
+    """
+    Request a new access token from the Copernicus Data Space identity server.
+    """
+    return request_token(auth_data)["access_token"]
+
+
+class TokenManager:
+    """
+    OAuth access token shared by all threads and coroutines of a process.
+
+    The token is requested lazily on first use and refreshed proactively,
+    REFRESH_MARGIN seconds before its `expires_in` runs out, so requests never
+    go out with an expiring token. Refreshes are single-flight: callers that
+    need a new token at the same time wait for one request to the identity
+    server. A token rejected by the API is dropped with invalidate().
+    """
+
+    def __init__(self, auth_data=None, refresh_margin=REFRESH_MARGIN, auth_url=AUTH_URL):
+        self.auth_data = auth_data if auth_data is not None else load_auth_data()
+        self.refresh_margin = refresh_margin
+        self.auth_url = auth_url
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _valid(self):
+        return self._token is not None and time.monotonic() < self._expires_at - self.refresh_margin
+
+    def token(self):
+        """
+        A valid access token, refreshing it first if it is about to expire.
+        """
+        if self._valid():
+            return self._token
+        with self._lock:
+            # Another thread may have refreshed while this one waited
+            if not self._valid():
+                data = request_token(self.auth_data, self.auth_url)
+                expires_in = float(data.get("expires_in", DEFAULT_EXPIRES_IN))
+                self._token = data["access_token"]
+                # Never refresh more often than every few seconds for short-lived tokens
+                self._expires_at = time.monotonic() + max(expires_in, self.refresh_margin + 5)
+            return self._token
+
+    async def token_async(self):
+        """
+        Like token(), but refreshes in a thread so the event loop keeps running.
+        """
+        if self._valid():
+            return self._token
+        return await asyncio.to_thread(self.token)
+
+    def invalidate(self, token):
+        """
+        Drop `token` after the API rejected it (401), unless it was already replaced.
+        """
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(path=CLIENT_INFO_PATH):
+    """
+    The token manager for the credentials in `path`, shared by all extractors of the process.
+    """
+    with _managers_lock:
+        if path not in _managers:
+            _managers[path] = TokenManager(load_auth_data(path))
+        return _managers[path]
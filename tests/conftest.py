@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+# The extractors import each other as top-level modules, as when run from dataGathering/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataGathering"))
+
+from metrics import Metrics  # noqa: E402
+from mock_servers import MockServers  # noqa: E402
+from token_manager import TokenManager  # noqa: E402
+
+
+class RecordingServers(MockServers):
+    """
+    MockServers that also keep the JSON payloads of the statistics requests.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statistics_payloads = []
+
+    async def _statistics(self, request):
+        self.statistics_payloads.append(await request.json())
+        return await super()._statistics(request)
+
+
+@pytest.fixture
+def servers():
+    with RecordingServers(latency=0) as servers:
+        yield servers
+
+
+@pytest.fixture
+def engine_kwargs(servers, tmp_path):
+    """
+    Engine arguments pointing at the mock servers, without response cache or
+    rate limiter and with metrics exported under tmp_path.
+    """
+    return {
+        "token_manager": TokenManager({"client_id": "test", "client_secret": "test"}, auth_url=servers.auth_url),
+        "cache": False,
+        "limiter": False,
+        "decode_workers": 1,
+        "metrics": Metrics("test", directory=str(tmp_path / "metrics"), prometheus_dir=None),
+    }
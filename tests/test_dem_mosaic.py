@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from dem_mosaic import read_dem_windows
+from slope_kernel import METERS_PER_DEGREE, slope_statistics
+
+PIXEL_DEG = 0.01
+TILE_PX = 100  # 1 degree tiles
+NORTH = 47.0
+# Rise per metre towards the north and towards the east
+GRADIENT_NORTH, GRADIENT_EAST = 0.4, 0.3
+BUFFER_DEG, WINDOW_PX = 0.05, 10  # windows on the DEM pixel grid
+
+
+def plane(lons, lats):
+    """
+    Elevations of a tilted plane, in metres: the east-west term is scaled
+    by the cosine of the mosaic's mid latitude, so both gradients are
+    constant per metre of ground distance up to the latitude change within
+    a window.
+    """
+    return (GRADIENT_NORTH * (lats - 46.0) * METERS_PER_DEGREE
+            + GRADIENT_EAST * (lons - 7.0) * METERS_PER_DEGREE * np.cos(np.radians(46.5)) + 1000)
+
+
+@pytest.fixture
+def mosaic(tmp_path):
+    """
+    VRT mosaic of two adjacent 1 degree tiles, N46E007 and N46E008, as built
+    by gdalbuildvrt.
+    """
+    sources = []
+    for i, west in enumerate((7.0, 8.0)):
+        centers = (np.arange(TILE_PX) + 0.5) * PIXEL_DEG
+        lons, lats = np.meshgrid(west + centers, NORTH - centers)
+        name = f"N46E00{int(west)}.tif"
+        with rasterio.open(tmp_path / name, "w", driver="GTiff", width=TILE_PX, height=TILE_PX, count=1,
+                           dtype="float32", crs="EPSG:4326", nodata=-32767,
+                           transform=from_origin(west, NORTH, PIXEL_DEG, PIXEL_DEG)) as dst:
+            dst.write(plane(lons, lats).astype(np.float32), 1)
+        sources.append(
+            f'<SimpleSource><SourceFilename relativeToVRT="1">{name}</SourceFilename><SourceBand>1</SourceBand>'
+            f'<SrcRect xOff="0" yOff="0" xSize="{TILE_PX}" ySize="{TILE_PX}"/>'
+            f'<DstRect xOff="{i * TILE_PX}" yOff="0" xSize="{TILE_PX}" ySize="{TILE_PX}"/></SimpleSource>'
+        )
+    path = os.path.join(tmp_path, "mosaic.vrt")
+    with open(path, "w") as f:
+        f.write(f'<VRTDataset rasterXSize="{2 * TILE_PX}" rasterYSize="{TILE_PX}">'
+                f'<SRS>{CRS.from_epsg(4326).to_wkt()}</SRS>'
+                f'<GeoTransform>7.0, {PIXEL_DEG}, 0.0, {NORTH}, 0.0, {-PIXEL_DEG}</GeoTransform>'
+                f'<VRTRasterBand dataType="Float32" band="1"><NoDataValue>-32767</NoDataValue>'
+                f'{"".join(sources)}</VRTRasterBand></VRTDataset>')
+    return path
+
+
+def window_centers(lat, lon):
+    centers = (np.arange(WINDOW_PX) + 0.5) * 2 * BUFFER_DEG / WINDOW_PX
+    return np.meshgrid(lon - BUFFER_DEG + centers, lat + BUFFER_DEG - centers)
+
+
+def analytic_slope(lat):
+    # The east-west gradient per metre changes with the cosine of the latitude
+    east = GRADIENT_EAST * np.cos(np.radians(46.5)) / np.cos(np.radians(lat))
+    return np.degrees(np.arctan(np.hypot(east, GRADIENT_NORTH)))
+
+
+def test_windows_across_the_tile_seam_match_the_plane(mosaic):
+    # Inside the western tile, across the seam at 8°E, inside the eastern tile
+    lats = np.array([46.5, 46.5, 46.3])
+    lons = np.array([7.5, 8.0, 8.6])
+    stack = read_dem_windows(mosaic, lats, lons, buffer_deg=BUFFER_DEG, window_px=WINDOW_PX, workers=2)
+
+    assert stack.shape == (3, WINDOW_PX, WINDOW_PX)
+    for window, lat, lon in zip(stack, lats, lons):
+        np.testing.assert_allclose(window, plane(*window_centers(lat, lon)), rtol=1e-5)
+
+    bboxes = np.stack([lons - BUFFER_DEG, lats - BUFFER_DEG, lons + BUFFER_DEG, lats + BUFFER_DEG], axis=1)
+    slopes = slope_statistics(stack, bboxes)
+    np.testing.assert_allclose(slopes["slope_degrees"], analytic_slope(lats), rtol=1e-3)
+    np.testing.assert_allclose(slopes["slope_max"], analytic_slope(lats), rtol=1e-3)
+
+
+def test_windows_at_the_mosaic_edge_read_boundless(mosaic):
+    # Windows reaching 3 pixels past the western and northern edges
+    lats = np.array([46.5, 46.98])
+    lons = np.array([7.02, 7.5])
+    stack = read_dem_windows(mosaic, lats, lons, buffer_deg=BUFFER_DEG, window_px=WINDOW_PX)
+
+    west, north = stack
+    assert np.isnan(west[:, :3]).all() and np.isnan(north[:3]).all()
+    np.testing.assert_allclose(west[:, 3:], plane(*window_centers(46.5, 7.02))[:, 3:], rtol=1e-5)
+    np.testing.assert_allclose(north[3:], plane(*window_centers(46.98, 7.5))[3:], rtol=1e-5)
+
+    bboxes = np.stack([lons - BUFFER_DEG, lats - BUFFER_DEG, lons + BUFFER_DEG, lats + BUFFER_DEG], axis=1)
+    slopes = slope_statistics(stack, bboxes)
+    np.testing.assert_allclose(slopes["slope_degrees"], analytic_slope(lats), rtol=1e-3)
+
+
+def test_windows_outside_the_mosaic_are_nan(mosaic):
+    stack = read_dem_windows(mosaic, [40.0], [7.5], buffer_deg=BUFFER_DEG, window_px=WINDOW_PX)
+    assert np.isnan(stack).all()
+    assert read_dem_windows(mosaic, [], [], buffer_deg=BUFFER_DEG, window_px=WINDOW_PX).shape == (0, 10, 10)
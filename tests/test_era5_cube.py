@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from era5_cube import mean_daily_precipitation
+
+RESOLUTION = 0.25  # ERA5 grid spacing in degrees
+
+
+def rain(lats, lons):
+    """
+    Daily precipitation in mm of the synthetic cube, linear in latitude and
+    longitude (in -180..180), so bilinear interpolation is exact.
+    """
+    return 2.0 + 0.5 * (lats - 50.0) + 0.8 * lons
+
+
+@pytest.fixture(params=["0..360", "-180..180"])
+def cube(request, tmp_path):
+    """
+    Zarr cube of two days of hourly ERA5 'tp' in metres over 48..53°N, on the
+    full 0..359.75 longitude axis as downloaded from the CDS, or -180..179.75.
+    """
+    lats = np.arange(53.0, 47.99, -RESOLUTION)  # descending, as in ERA5
+    if request.param == "0..360":
+        lons = np.arange(0.0, 360.0, RESOLUTION)
+    else:
+        lons = np.arange(-180.0, 180.0, RESOLUTION)
+    signed_lons = ((lons + 180) % 360) - 180
+    daily = rain(lats[:, None], signed_lons[None, :])
+    times = pd.date_range("2024-01-01", periods=48, freq="h")
+    tp = np.broadcast_to(daily / 24 / 1000, (len(times), *daily.shape))
+    ds = xr.Dataset(
+        {"tp": (("valid_time", "latitude", "longitude"), tp, {"units": "m"})},
+        coords={"valid_time": times, "latitude": lats, "longitude": lons},
+    )
+    path = str(tmp_path / "era5.zarr")
+    ds.to_zarr(path)
+    return path
+
+
+# London and plants just west and east of the prime meridian
+LATS = np.array([51.5, 51.5, 51.5, 50.1, 52.0])
+LONS = np.array([-0.1, -0.13, -0.2, 0.1, 1.3])
+
+
+@pytest.mark.parametrize("method", ["nearest", "bilinear"])
+def test_locations_on_both_sides_of_the_prime_meridian(cube, method):
+    values = mean_daily_precipitation(cube, LATS, LONS, start_date="2024-01-01", end_date="2024-01-02",
+                                      method=method)
+    assert not np.isnan(values).any()
+    if method == "bilinear":
+        expected = rain(LATS, LONS)
+    else:
+        expected = rain(np.round(LATS / RESOLUTION) * RESOLUTION, np.round(LONS / RESOLUTION) * RESOLUTION)
+    np.testing.assert_allclose(values, expected, rtol=1e-6)
+
+
+def test_locations_outside_the_cube_are_nan(cube):
+    values = mean_daily_precipitation(cube, [51.5, 40.0], [-0.1, -0.1], start_date="2024-01-01",
+                                      end_date="2024-01-02")
+    assert not np.isnan(values[0]) and np.isnan(values[1])
@@ -0,0 +1,20 @@
+import pandas as pd
+
+from extraction_engine import ExtractionEngine
+from get_ndvi_values import get_ndvi, ndvi_from_stack
+
+
+def test_run_returns_results_in_location_order(servers, engine_kwargs):
+    # Interleaved locations of two distant clusters, so tile and Hilbert
+    # order differ from the input order
+    locations = pd.DataFrame({
+        "name": [f"Plant {i}" for i in range(6)],
+        "latitude": [46.50, 40.10, 46.51, 40.11, 46.52, 40.12],
+        "longitude": [7.50, 14.20, 7.51, 14.21, 7.52, 14.22],
+    })
+    engine = ExtractionEngine(api_url=servers.process_url, **engine_kwargs)
+    results = engine.run(locations, get_ndvi, ndvi_from_stack, "ndvi")
+
+    assert [(r["name"], r["latitude"], r["longitude"]) for r in results] == \
+        list(locations.itertuples(index=False, name=None))
+    assert all(r["ndvi"] is not None for r in results)
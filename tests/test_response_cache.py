@@ -0,0 +1,39 @@
+import os
+import sqlite3
+
+from response_cache import ResponseCache
+
+
+def last_access(cache, key):
+    # Read through a separate connection, so only committed access times are seen
+    with sqlite3.connect(os.path.join(cache.path, "index.sqlite")) as db:
+        return db.execute("SELECT last_access FROM entries WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hits_are_written_in_batches(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    cache.put("aa01", b"first")
+    stored = last_access(cache, "aa01")
+
+    assert cache.get("aa01") == b"first"
+    assert cache.get("bb02") is None
+    assert last_access(cache, "aa01") == stored
+
+    cache.flush()
+    assert last_access(cache, "aa01") > stored
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_eviction_sees_buffered_hits(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=30)
+    for key in ("aa01", "bb02", "cc03"):
+        cache.put(key, b"x" * 10)
+    # The oldest entry was used last, so the next put evicts the second one
+    cache.get("aa01")
+    cache.put("dd04", b"x" * 10)
+
+    assert cache.get("aa01") is not None
+    assert cache.get("bb02") is None
+    assert cache.get("cc03") is not None
+    cache.close()
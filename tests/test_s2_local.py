@@ -0,0 +1,146 @@
+import json
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from s2_local import BOA_ADD_OFFSET, extract_local_indices, find_scenes, tile_indices
+
+BANDS = ["B03", "B04", "B08", "B11", "SCL"]
+PIXEL_DEG = 0.001
+WEST, NORTH = 7.0, 46.01
+SIZE = 10  # pixels per side of the synthetic scenes
+VEGETATION, WATER, CLOUD = 4, 6, 9
+
+
+def write_scene(root, name, b03=2000, b04=1000, b08=3000, b11=1500, scl=VEGETATION, west=WEST, size=SIZE,
+                cloud_cover=None):
+    """
+    Write a scene directory of constant (or per-pixel, as arrays) COG-style
+    band files on a 0.001 degree EPSG:4326 grid.
+    """
+    directory = os.path.join(root, name)
+    os.makedirs(directory)
+    for band, value in zip(BANDS, (b03, b04, b08, b11, scl)):
+        dtype = "uint8" if band == "SCL" else "uint16"
+        array = np.broadcast_to(np.asarray(value, dtype=dtype), (size, size))
+        with rasterio.open(os.path.join(directory, f"{band}.tif"), "w", driver="GTiff", width=size, height=size,
+                           count=1, dtype=dtype, crs="EPSG:4326",
+                           transform=from_origin(west, NORTH, PIXEL_DEG, PIXEL_DEG)) as dst:
+            dst.write(array, 1)
+    if cloud_cover is not None:
+        with open(os.path.join(directory, "item.json"), "w") as f:
+            json.dump({"properties": {"eo:cloud_cover": cloud_cover}}, f)
+    return directory
+
+
+def write_safe_metadata(directory, cloud_cover, offset):
+    with open(os.path.join(directory, "MTD_MSIL2A.xml"), "w") as f:
+        f.write(f"<Level-2A_User_Product><General_Info><Product_Image_Characteristics>"
+                f"<BOA_ADD_OFFSET_VALUES_LIST><BOA_ADD_OFFSET band_id=\"0\">{offset}</BOA_ADD_OFFSET>"
+                f"</BOA_ADD_OFFSET_VALUES_LIST></Product_Image_Characteristics></General_Info>"
+                f"<Quality_Indicators_Info><Cloud_Coverage_Assessment>{cloud_cover}</Cloud_Coverage_Assessment>"
+                f"</Quality_Indicators_Info></Level-2A_User_Product>")
+
+
+def indices_at(scenes, pixels, indices=("ndvi", "ndwi"), width=SIZE):
+    """
+    Index values of single-pixel windows at (row, col) `pixels` of a tile
+    covering the scenes' grid.
+    """
+    bbox = (WEST, NORTH - SIZE * PIXEL_DEG, WEST + width * PIXEL_DEG, NORTH)
+    return tile_indices(bbox, width, SIZE, pixels, 1, scenes, list(indices))
+
+
+def test_find_scenes_filters_dates_and_cloud_cover(tmp_path):
+    write_scene(tmp_path, "20210520")
+    write_scene(tmp_path, "20210601", cloud_cover=5)
+    write_scene(tmp_path, "20210611", cloud_cover=50)
+    write_scene(tmp_path, "20210620")
+    write_scene(tmp_path, "20211001")
+    os.makedirs(tmp_path / "no_date")
+
+    scenes = find_scenes(str(tmp_path), BANDS, "2021-06-01", "2021-09-30", max_cloud_cover=10)
+    # The cloudy scene is skipped, the one without metadata kept
+    assert [(str(s.date), s.cloud_cover) for s in scenes] == [("2021-06-01", 5.0), ("2021-06-20", None)]
+    assert scenes[0].bands["B08"].endswith(os.path.join("20210601", "B08.tif"))
+    assert scenes[0].bounds == pytest.approx((WEST, NORTH - SIZE * PIXEL_DEG, WEST + SIZE * PIXEL_DEG, NORTH))
+
+
+def test_find_scenes_skips_scenes_with_missing_bands(tmp_path):
+    directory = write_scene(tmp_path, "20210601")
+    os.remove(os.path.join(directory, "B11.tif"))
+    write_scene(tmp_path, "20210611")
+    assert [str(s.date) for s in find_scenes(str(tmp_path), BANDS)] == ["2021-06-11"]
+    assert len(find_scenes(str(tmp_path), ["B03", "B04", "B08", "SCL"])) == 2
+
+
+def test_find_scenes_chooses_boa_offset(tmp_path):
+    # Baseline in the product name, then acquisition date, then SAFE metadata
+    write_scene(tmp_path, "S2A_MSIL2A_20210601T101559_N0300_R022_T32TMS_20210601T120000.SAFE")
+    write_scene(tmp_path, "S2A_MSIL2A_20210611T101559_N0400_R022_T32TMS_20210611T120000.SAFE")
+    write_scene(tmp_path, "20220120")
+    write_scene(tmp_path, "20220301")
+    safe = write_scene(tmp_path, "S2B_MSIL2A_20220401T101559_N0400_R022_T32TMS_20220401T120000.SAFE")
+    write_safe_metadata(safe, cloud_cover=3.5, offset=0)
+
+    offsets = {str(s.date): (s.offset, s.cloud_cover) for s in find_scenes(str(tmp_path), BANDS)}
+    assert offsets == {
+        "2021-06-01": (0, None),
+        "2021-06-11": (BOA_ADD_OFFSET, None),
+        "2022-01-20": (0, None),
+        "2022-03-01": (BOA_ADD_OFFSET, None),
+        "2022-04-01": (0, 3.5),
+    }
+
+
+def test_tile_indices_masks_scene_classes_per_index(tmp_path):
+    # Water in the left half, vegetation in the right half
+    scl = np.full((SIZE, SIZE), VEGETATION, dtype=np.uint8)
+    scl[:, :SIZE // 2] = WATER
+    write_scene(tmp_path, "20210601", scl=scl)
+    write_scene(tmp_path, "20210611", scl=CLOUD)
+    scenes = find_scenes(str(tmp_path), BANDS)
+
+    values = indices_at(scenes, [(0, 0), (0, SIZE - 1)])
+    # Water is only skipped for NDVI, clouds for every index
+    assert np.isnan(values["ndvi"][0])
+    assert values["ndvi"][1] == pytest.approx((3000 - 1000) / (3000 + 1000))
+    assert values["ndwi"] == pytest.approx([(2000 - 3000) / (2000 + 3000)] * 2)
+
+
+def test_tile_indices_averages_acquisitions(tmp_path):
+    write_scene(tmp_path, "20210601", b08=3000)
+    write_scene(tmp_path, "20210611", b08=4000)
+    # Digital numbers with the offset of processing baseline 04.00, so the same as the first scene
+    write_scene(tmp_path, "20220601", b03=3000, b04=2000, b08=4000)
+    scenes = find_scenes(str(tmp_path), BANDS)
+
+    bbox = (WEST, NORTH - SIZE * PIXEL_DEG, WEST + SIZE * PIXEL_DEG, NORTH)
+    values = tile_indices(bbox, SIZE, SIZE, [(0, 0), (5, 5)], 5, scenes, ["ndvi", "ndwi"])
+    assert values["ndvi"] == pytest.approx([(0.5 + 0.6 + 0.5) / 3] * 2)
+    assert values["ndwi"] == pytest.approx([(-0.2 - 1 / 3 - 0.2) / 3] * 2)
+
+
+def test_tile_indices_counts_overlapping_granules_once(tmp_path):
+    # Two granules of one acquisition overlapping in columns 5 to 9, and a later
+    # acquisition covering the whole tile
+    write_scene(tmp_path, "20210601_T32TLS", b08=3000)
+    write_scene(tmp_path, "20210601_T32TMS", b08=1500, west=WEST + 5 * PIXEL_DEG)
+    write_scene(tmp_path, "20210611", b08=4000, size=15)
+    scenes = find_scenes(str(tmp_path), BANDS)
+
+    values = indices_at(scenes, [(0, 2), (0, 7), (0, 12)], indices=("ndvi",), width=15)
+    # Overlapping pixels come from the first granule, and every acquisition counts once
+    assert values["ndvi"] == pytest.approx([(0.5 + 0.6) / 2, (0.5 + 0.6) / 2, (0.2 + 0.6) / 2])
+
+
+def test_missing_scenes_directory_raises_value_error(tmp_path):
+    with pytest.raises(ValueError, match="S2_SCENES_DIR"):
+        find_scenes(None, BANDS)
+    with pytest.raises(ValueError, match="S2_SCENES_DIR"):
+        extract_local_indices("ndvi", None, None, ["ndvi"], scenes_dir=None)
+    with pytest.raises(ValueError, match="does not exist"):
+        find_scenes(str(tmp_path / "missing"), BANDS)
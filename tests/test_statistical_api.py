@@ -0,0 +1,108 @@
+import functools
+
+import pandas as pd
+import pytest
+
+import statistical_api
+from checkpoint_store import CheckpointStore
+from get_ndvi_values import get_ndvi
+from statistical_api import (
+    DATA_MASK_WRAPPER, StatisticsEngine, extract_series, extract_statistics, series_columns, statistical_request,
+    statistics_columns,
+)
+
+LOCATIONS = pd.DataFrame({
+    "name": ["Plant A", "Plant B", None, "Plant D"],
+    "latitude": [46.5, 46.9, 45.2, 47.1],
+    "longitude": [7.5, 8.1, 9.3, 10.2],
+})
+PIXELS = 50 * 50  # get_ndvi requests 50 x 50 pixel windows
+VALID_PIXELS = PIXELS - PIXELS // 10  # the mock servers report a tenth as no data
+
+
+@pytest.fixture
+def checkpoint_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "checkpoints.sqlite")
+    monkeypatch.setattr(statistical_api, "CheckpointStore", functools.partial(CheckpointStore, path=path))
+    return path
+
+
+def test_statistical_request_wraps_evalscript_and_aggregates_whole_range():
+    payload = get_ndvi(46.5, 7.5)
+    request = statistical_request(payload)
+
+    aggregation = request["aggregation"]
+    assert aggregation["evalscript"] == payload["evalscript"] + DATA_MASK_WRAPPER
+    # 2024-04-01T00:00:00Z to 2024-09-30T23:59:59Z, rounded up to whole days
+    assert aggregation["aggregationInterval"] == {"of": "P183D", "lastIntervalBehavior": "EXTEND"}
+    assert aggregation["timeRange"] == payload["input"]["data"][0]["dataFilter"]["timeRange"]
+    assert (aggregation["width"], aggregation["height"]) == (50, 50)
+    assert request["input"] == payload["input"]
+    assert request["calculations"]["default"]["statistics"]["default"]["percentiles"]["k"] == [10, 50, 90]
+
+
+def test_statistical_request_with_interval_shortens_last_interval():
+    request = statistical_request(get_ndvi(46.5, 7.5), percentiles=(), interval="P1M")
+    assert request["aggregation"]["aggregationInterval"] == {"of": "P1M", "lastIntervalBehavior": "SHORTEN"}
+    assert "calculations" not in request
+
+
+def test_engine_sends_statistical_requests_and_parses_statistics(servers, engine_kwargs):
+    engine = StatisticsEngine(api_url=servers.statistics_url, **engine_kwargs)
+    results = engine.run(LOCATIONS, get_ndvi, "ndvi")
+
+    assert len(servers.statistics_payloads) == len(LOCATIONS)
+    sent = {tuple(p["input"]["bounds"]["bbox"]) for p in servers.statistics_payloads}
+    assert sent == {tuple(get_ndvi(lat, lon)["input"]["bounds"]["bbox"])
+                    for lat, lon in zip(LOCATIONS["latitude"], LOCATIONS["longitude"])}
+    for payload in servers.statistics_payloads:
+        assert payload["aggregation"]["evalscript"].endswith(DATA_MASK_WRAPPER)
+        assert payload["aggregation"]["aggregationInterval"] == {"of": "P183D", "lastIntervalBehavior": "EXTEND"}
+
+    assert [r["name"] for r in results] == LOCATIONS["name"].tolist()
+    assert statistics_columns("ndvi") == ["ndvi", "ndvi_std", "ndvi_p10", "ndvi_p50", "ndvi_p90",
+                                          "ndvi_valid_pixels"]
+    for result in results:
+        assert set(statistics_columns("ndvi")) <= set(result)
+        assert result["ndvi_std"] == pytest.approx(0.1)
+        # The mock percentiles are mean + (k - 50) / 250
+        assert result["ndvi_p10"] == pytest.approx(result["ndvi"] - 0.16)
+        assert result["ndvi_p50"] == pytest.approx(result["ndvi"])
+        assert result["ndvi_p90"] == pytest.approx(result["ndvi"] + 0.16)
+        assert result["ndvi_valid_pixels"] == VALID_PIXELS
+
+
+def test_extract_statistics_resumes_from_checkpoint(servers, engine_kwargs, checkpoint_path):
+    first = extract_statistics("ndvi", LOCATIONS.iloc[:2], get_ndvi, api_url=servers.statistics_url,
+                               **engine_kwargs)
+    assert servers.requests[("statistics", 200)] == 2
+
+    results = extract_statistics("ndvi", LOCATIONS, get_ndvi, api_url=servers.statistics_url, **engine_kwargs)
+    # Only the two locations missing from the checkpoint are requested again
+    assert servers.requests[("statistics", 200)] == 4
+    assert [(r["latitude"], r["longitude"]) for r in results] == list(zip(LOCATIONS["latitude"],
+                                                                          LOCATIONS["longitude"]))
+    assert results[:2] == first
+    assert all(r["ndvi"] is not None for r in results)
+
+
+def test_extract_series_returns_one_row_per_location_and_month(servers, engine_kwargs, checkpoint_path):
+    series = extract_series("ndvi", LOCATIONS, get_ndvi, interval="P1M", percentiles=(50,),
+                            api_url=servers.statistics_url, **engine_kwargs)
+
+    for payload in servers.statistics_payloads:
+        assert payload["aggregation"]["aggregationInterval"] == {"of": "P1M", "lastIntervalBehavior": "SHORTEN"}
+        assert payload["calculations"]["default"]["statistics"]["default"]["percentiles"]["k"] == [50]
+
+    assert series_columns((50,)) == ["mean", "std", "p50", "valid_pixels"]
+    assert list(series.columns) == ["name", "latitude", "longitude", "date", "mean", "std", "p50", "valid_pixels"]
+    assert len(series) == len(LOCATIONS) * 6
+    assert sorted(series["date"].unique()) == [f"2024-{month:02d}-01" for month in range(4, 10)]
+    assert (series["valid_pixels"] == VALID_PIXELS).all()
+    assert series["p50"].to_numpy() == pytest.approx(series["mean"].to_numpy())
+
+    # A second run is served from the checkpoint
+    again = extract_series("ndvi", LOCATIONS, get_ndvi, interval="P1M", percentiles=(50,),
+                           api_url=servers.statistics_url, **engine_kwargs)
+    assert servers.requests[("statistics", 200)] == len(LOCATIONS)
+    pd.testing.assert_frame_equal(again, series)